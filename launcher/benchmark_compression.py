@@ -0,0 +1,55 @@
+"""
+Benchmark the output compression profiles on an already-stitched plate.
+
+Every stitched image in a plate's output directory is re-encoded with each
+profile in `output.COMPRESSION_PROFILES`, reporting the encode time and the
+total bytes per plate.
+
+usage: python benchmark_compression.py /path/to/stitched/plate [n_repeats]
+"""
+
+import os
+import sys
+import time
+
+import numpy as np
+import skimage.io
+from output import COMPRESSION_PROFILES, encode_image
+
+
+def load_stitched_images(plate_dir: str) -> list:
+    imgs = []
+    for name in sorted(os.listdir(plate_dir)):
+        if name.endswith((".png", ".webp")):
+            img = skimage.io.imread(os.path.join(plate_dir, name))
+            imgs.append(np.ascontiguousarray(img, dtype=np.uint8))
+    return imgs
+
+
+def benchmark(imgs: list, n_repeats: int = 1):
+    """yield (profile name, best encode time, total bytes) for each profile"""
+    for name, profile in COMPRESSION_PROFILES.items():
+        times = []
+        for _ in range(n_repeats):
+            start = time.perf_counter()
+            n_bytes = sum(len(encode_image(img, profile)) for img in imgs)
+            times.append(time.perf_counter() - start)
+        yield name, min(times), n_bytes
+
+
+def main():
+    plate_dir = sys.argv[1]
+    n_repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 1
+    imgs = load_stitched_images(plate_dir)
+    if not imgs:
+        sys.exit(f"no stitched images found in {plate_dir}")
+    raw_mb = sum(img.nbytes for img in imgs) / 1024**2
+    print(f"{len(imgs)} images, {raw_mb:.1f} MB uncompressed")
+    print(f"{'profile':<22}{'encode (s)':>12}{'MB / plate':>12}{'ratio':>8}")
+    for name, seconds, n_bytes in benchmark(imgs, n_repeats):
+        mb = n_bytes / 1024**2
+        print(f"{name:<22}{seconds:>12.2f}{mb:>12.2f}{raw_mb / mb:>8.1f}", flush=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""
+Benchmark updating a snapshot database with a large directory listing.
+
+A snapshot of `n_dirs` directory names is stored, then a listing in which
+`n_changed` names have been removed and `n_changed` new names added is
+compared against it and saved, both one name at a time with
+`SnapshotDB.is_new_dir()` and a full rewrite of the snapshot, and with the
+set-based `SnapshotDB.diff()` and `SnapshotDB.apply_delta()`.
+
+usage: python benchmark_snapshot.py [n_dirs] [n_changed]
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+from snapshot import SnapshotDB, hash_dirnames
+
+
+def make_dirnames(start: int, stop: int) -> list:
+    return [f"S{i:08d}__2021-01-01T00_00_00-Measurement 1" for i in range(start, stop)]
+
+
+def per_dir(db: SnapshotDB, dirnames: list) -> int:
+    new_dirs = [i for i in dirnames if db.is_new_dir(i)]
+    db.drop_snapshot()
+    db.create_snapshot(dirnames)
+    db.add_hash(hash_dirnames(dirnames))
+    return len(new_dirs)
+
+
+def set_based(db: SnapshotDB, dirnames: list) -> int:
+    new_dirs, removed_dirs = db.diff(dirnames)
+    db.apply_delta(new_dirs, removed_dirs, hash_dirnames(dirnames))
+    return len(new_dirs)
+
+
+def benchmark(n_dirs: int, n_changed: int):
+    """yield (method name, seconds, number of new directories) for each method"""
+    stored = make_dirnames(0, n_dirs)
+    listing = make_dirnames(n_changed, n_dirs + n_changed)
+    for name, method in [("per-directory", per_dir), ("set-based", set_based)]:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            db = SnapshotDB(os.path.join(tmp_dir, "snapshot.db"))
+            db.create_snapshot(stored)
+            start = time.perf_counter()
+            n_new = method(db, listing)
+            seconds = time.perf_counter() - start
+            db.con.close()
+        yield name, seconds, n_new
+
+
+def main():
+    n_dirs = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    n_changed = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    print(f"{n_dirs} directories, {n_changed} added and {n_changed} removed")
+    print(f"{'method':<16}{'time (s)':>10}{'new':>8}")
+    for name, seconds, n_new in benchmark(n_dirs, n_changed):
+        print(f"{name:<16}{seconds:>10.3f}{n_new:>8}", flush=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+"""
+Local checkpoints of stitching progress.
+
+If a stitching worker is killed part way through a plate, e.g by the OOM
+killer or a restart, the retried task would otherwise have to download
+every image again. While a plate is stitched its finished thumbnails are
+periodically saved to a checkpoint directory on local disk, keyed by plate
+barcode, and a retry of the same indexfile with the same parameters picks up
+the saved thumbnails rather than fetching their images again.
+The checkpoint is deleted once the stitching task succeeds.
+"""
+
+import io
+import json
+import logging
+import os
+import shutil
+import tempfile
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from config import parse_config
+
+cfg_stitch = parse_config()["image_stitching"]
+
+CHECKPOINT_DIR = cfg_stitch["checkpoint_dir"]
+CHECKPOINT_INTERVAL = cfg_stitch.getint("checkpoint_interval")
+META_NAME = "meta.json"
+
+log = logging.getLogger(__name__)
+
+# (row, column, channel ID) of an indexfile row
+Key = Tuple[int, int, int]
+
+
+class Checkpoint:
+    """
+    Thumbnails saved for a plate, as numbered chunks of up to `interval`
+    thumbnails in `<checkpoint_dir>/<plate_barcode>/`.
+    Each chunk is an uncompressed npz file of the row keys and their sample
+    and plate-well thumbnails, written atomically so a chunk is either
+    complete or missing. `version` identifies the indexfile and stitching
+    parameters, existing chunks from a different version are removed.
+    """
+
+    def __init__(
+        self,
+        plate_barcode: str,
+        version: str,
+        checkpoint_dir: str = CHECKPOINT_DIR,
+        interval: int = CHECKPOINT_INTERVAL,
+    ):
+        self.path = os.path.join(checkpoint_dir, plate_barcode)
+        self.version = version
+        self.interval = interval
+        self.thumbnails: Dict[Key, Tuple[np.ndarray, np.ndarray]] = {}
+        self.pending: List[Tuple[Key, np.ndarray, np.ndarray]] = []
+        self.n_chunks = 0
+        os.makedirs(self.path, exist_ok=True)
+        if self.read_version() == version:
+            self.load()
+        else:
+            self.clear()
+
+    def read_version(self) -> Optional[str]:
+        try:
+            with open(os.path.join(self.path, META_NAME)) as f:
+                return json.load(f)["version"]
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def clear(self) -> None:
+        """remove any existing chunks and start a new checkpoint"""
+        for name in os.listdir(self.path):
+            os.remove(os.path.join(self.path, name))
+        self.write_file(META_NAME, json.dumps({"version": self.version}).encode())
+
+    def load(self) -> None:
+        """load thumbnails from every complete chunk"""
+        chunks = sorted(
+            name
+            for name in os.listdir(self.path)
+            if name.startswith("chunk_") and name.endswith(".npz")
+        )
+        for name in chunks:
+            try:
+                with np.load(os.path.join(self.path, name)) as chunk:
+                    keys, sample, plate_well = (
+                        chunk["keys"],
+                        chunk["sample"],
+                        chunk["plate_well"],
+                    )
+            except (OSError, ValueError, KeyError) as err:
+                log.warning(f"ignoring unreadable checkpoint {name}: {err}")
+                continue
+            for key, img_sample, img_plate_well in zip(keys, sample, plate_well):
+                self.thumbnails[tuple(int(i) for i in key)] = (
+                    img_sample,
+                    img_plate_well,
+                )
+        self.n_chunks = len(chunks)
+        if self.thumbnails:
+            log.info(f"resuming from {len(self.thumbnails)} checkpointed images")
+
+    def get(self, key: Key) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        """get the sample and plate-well thumbnails of a row, if saved"""
+        return self.thumbnails.get(key)
+
+    def add(self, key: Key, img_sample: np.ndarray, img_plate_well: np.ndarray):
+        """add finished thumbnails, saving a chunk every `interval` images"""
+        self.pending.append((key, img_sample, img_plate_well))
+        if len(self.pending) >= self.interval:
+            self.flush()
+
+    def flush(self) -> None:
+        """save thumbnails added since the last chunk as a new chunk"""
+        if not self.pending:
+            return
+        keys, sample, plate_well = zip(*self.pending)
+        self.pending = []
+        buffer = io.BytesIO()
+        np.savez(
+            buffer,
+            keys=np.array(keys, dtype=np.int32),
+            sample=np.stack(sample),
+            plate_well=np.stack(plate_well),
+        )
+        try:
+            self.write_file(f"chunk_{self.n_chunks:05d}.npz", buffer.getvalue())
+        except OSError as err:
+            # stitching can carry on without a checkpoint
+            log.warning(f"failed to save checkpoint {self.path}: {err}")
+            return
+        self.n_chunks += 1
+
+    def write_file(self, name: str, data: bytes) -> None:
+        fd, tmp_path = tempfile.mkstemp(dir=self.path, prefix=".")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, os.path.join(self.path, name))
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+
+def delete_checkpoint(plate_barcode: str, checkpoint_dir: str = CHECKPOINT_DIR):
+    """remove a plate's checkpoint, if there is one"""
+    shutil.rmtree(os.path.join(checkpoint_dir, plate_barcode), ignore_errors=True)
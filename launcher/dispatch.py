@@ -4,16 +4,18 @@ module docstring
 
 import logging
 import os
-import sys
 import textwrap
-from typing import List
+import time
+from typing import List, Set
 
 import db
+import export
 import slack
 import task
 import utils
 from config import parse_config
 from db import AnalysisState, VariantLookupError
+from export import ExportState
 from snapshot import Snapshot
 
 log = logging.getLogger(__name__)
@@ -22,6 +24,10 @@ cfg_analysis = parse_config()["analysis"]
 
 RESULTS_DIR = cfg_analysis["results_dir"]
 SNAPSHOT_DB = cfg_analysis["snapshot_db"]
+SNAPSHOT_FULL_SCAN_INTERVAL = cfg_analysis.getint("snapshot_full_scan_interval")
+ANALYSIS_REQUIRED_FILES = export.parse_required_files(
+    cfg_analysis["analysis_required_files"]
+)
 
 
 class Dispatcher:
@@ -34,13 +40,25 @@ class Dispatcher:
         self,
         results_dir: str = RESULTS_DIR,
         db_path: str = SNAPSHOT_DB,
+        full_scan_interval: int = SNAPSHOT_FULL_SCAN_INTERVAL,
+        analysis_required_files: List[str] = ANALYSIS_REQUIRED_FILES,
     ):
         self.results_dir = results_dir
         self.db_path = db_path
+        self.full_scan_interval = full_scan_interval
+        # files the analysis reads, other than the indexfile
+        self.analysis_required_files = analysis_required_files
         engine = db.create_engine()
         session = db.create_session(engine)
         self.regex_filter = r"^[A-Z][0-9]{8}_.*-Measurement [0-9]$"
         self.database = db.Database(session)
+        self.snapshot = Snapshot(
+            self.results_dir,
+            self.db_path,
+            regex=self.regex_filter,
+            full_scan_interval=self.full_scan_interval,
+            track_pending=True,
+        )
 
     def get_new_directories(self) -> List[str]:
         """
@@ -48,24 +66,100 @@ class Dispatcher:
         This returns a list of all the new directories which match the given
         regex filter, which may contain multiple workflows and variants, and
         may not contain a matching replicate plate.
-        If no new valid directories are found, the entire process exits with
-        an exit code 0.
+        New directories are only returned once they have finished exporting,
+        until then they are kept as pending in the snapshot database and
+        checked again on each call, see `self.get_exported_directories()`.
+        If no new valid directories are found this returns an empty list.
         """
-        snapshot = Snapshot(self.results_dir, self.db_path, regex=self.regex_filter)
-        if snapshot.current_hash == snapshot.stored_hash:
-            log.info(
-                f"hash of {self.results_dir} contents remains unchanged, exiting..."
-            )
-            sys.exit(0)
-        new_data = snapshot.get_new_dirs()
-        if len(new_data) == 0:
-            log.info(
-                f"{self.results_dir} has changed, but no new valid directories found, exiting..."
-            )
-            snapshot.make_snapshot()
-            sys.exit(0)
-        snapshot.make_snapshot()
-        return new_data
+        # the results directory is only listed once per call, or not at all
+        # if it hasn't been modified
+        cycle = self.snapshot.cycle()
+        if cycle.is_unchanged:
+            log.debug(f"hash of {self.results_dir} contents remains unchanged")
+            cycle.record_scan()
+        else:
+            new_data = cycle.get_new_dirs()
+            if len(new_data) == 0:
+                log.info(
+                    f"{self.results_dir} has changed, but no new valid directories found"
+                )
+            else:
+                log.info(f"waiting for {len(new_data)} new directories to export")
+            cycle.save()
+        return self.get_exported_directories()
+
+    def get_exported_directories(self) -> List[str]:
+        """
+        Check the export of each pending directory, see
+        `export.get_export_state()`, and return those which have finished
+        exporting. These, along with directories which were abandoned
+        because they never had a usable indexfile, are no longer pending.
+        Exported directories whose other files needed for the analysis
+        aren't ready yet are then awaiting analysis, see
+        `self.get_analysis_ready_directories()`.
+        """
+        exported = []
+        done = []
+        awaiting_analysis = []
+        now = time.time()
+        for dirname, first_seen in self.snapshot.db.get_pending():
+            path = os.path.join(self.results_dir, dirname)
+            state = export.get_export_state(path, first_seen, now)
+            if state == ExportState.PENDING:
+                continue
+            done.append(dirname)
+            if state == ExportState.ABANDONED:
+                log.warning(f"{path} has no usable indexfile, no longer waiting")
+                slack.send_warning(f"Export never completed: {path}")
+                continue
+            if state == ExportState.INCOMPLETE:
+                log.warning(f"{path} indexfile is missing rows, dispatching anyway")
+            exported.append(path)
+            if not export.is_analysis_ready(path, self.analysis_required_files, now):
+                awaiting_analysis.append(dirname)
+        self.snapshot.db.rm_pending(done)
+        self.snapshot.db.add_awaiting_analysis(awaiting_analysis)
+        return exported
+
+    def get_analysis_ready_directories(self) -> List[str]:
+        """
+        Return directories which have been stitched, but whose analysis was
+        waiting on other files which are now ready, see
+        `export.is_analysis_ready()`. These, along with directories which
+        are given up on after `export.ABANDON_TIMEOUT` seconds, are no longer
+        awaiting analysis.
+        """
+        ready = []
+        done = []
+        now = time.time()
+        for dirname, first_seen in self.snapshot.db.get_awaiting_analysis():
+            path = os.path.join(self.results_dir, dirname)
+            if export.is_analysis_ready(path, self.analysis_required_files, now):
+                ready.append(path)
+            elif now - first_seen >= export.ABANDON_TIMEOUT:
+                log.warning(f"{path} has no analysis results, no longer waiting")
+                slack.send_warning(f"Analysis results never exported: {path}")
+            else:
+                continue
+            done.append(dirname)
+        self.snapshot.db.rm_awaiting_analysis(done)
+        return ready
+
+    def get_waiting_dirnames(self) -> Set[str]:
+        """
+        names of directories which are still exporting, or whose analysis is
+        waiting on other files
+        """
+        pending = self.snapshot.db.get_pending()
+        awaiting_analysis = self.snapshot.db.get_awaiting_analysis()
+        return {dirname for dirname, _ in pending + awaiting_analysis}
+
+    def has_pending(self) -> bool:
+        """
+        whether any new directories are still exporting, or waiting on files
+        for their analysis
+        """
+        return len(self.get_waiting_dirnames()) > 0
 
     def create_plate_list(self, workflow_id: str, variant: str) -> List[str]:
         """
@@ -74,13 +168,22 @@ class Dispatcher:
         It is inefficient, compared to simply pairing up replicate plates from
         `self.get_new_directories()`, but it is done this way to account
         for when replicate pairs are not exported at the same time.
+        Plates which haven't finished exporting, or whose files for the
+        analysis aren't ready, are left out, as the analysis is dispatched
+        again once they are.
         """
         all_subdirs = os.listdir(self.results_dir)
         full_paths = sorted([os.path.join(self.results_dir, i) for i in all_subdirs])
         variant_ints = self.database.get_variant_ints_from_name(variant)
+        waiting = self.get_waiting_dirnames()
         wanted_workflows = []
         for path in full_paths:
             if self.is_matching_plate(path, workflow_id, variant_ints):
+                dirname = os.path.basename(path)
+                if dirname in waiting or self.snapshot.db.is_new_dir(dirname):
+                    # still exporting, or not yet seen by the snapshot
+                    log.info(f"{path} hasn't finished exporting, skipping...")
+                    continue
                 wanted_workflows.append(path)
                 if len(wanted_workflows) == 2:
                     # already found both plates, no point continuing, exit early
@@ -98,9 +201,10 @@ class Dispatcher:
         plate_name = utils.get_plate_name(final_path)
         return plate_name[-6:] == workflow_id and int(final_path[1:3]) in variants
 
-    def dispatch_plate(self, plate_path: str) -> None:
+    def dispatch_plate(self, plate_path: str, stitching: bool = True) -> None:
         """
-        Given a single plate path, create image stitching job.
+        Given a single plate path, create image stitching job, unless
+        `stitching` is False.
         Then look if there is a matching replicate plate, if so create
         analysis job.
         """
@@ -114,7 +218,8 @@ class Dispatcher:
         except VariantLookupError as err:
             log.error(err)
             return
-        self.handle_stitching(plate_path, workflow_id, plate_name, is_titration)
+        if stitching:
+            self.handle_stitching(plate_path, workflow_id, plate_name, is_titration)
         plate_list = self.create_plate_list(workflow_id, variant)
         log.info(f"plate_list = {plate_list}")
         if len(plate_list) == 2:
@@ -0,0 +1,128 @@
+"""
+Detect when Harmony has finished exporting a plate.
+
+A plate's directory appears as soon as Harmony starts exporting it, before
+its `indexfile.txt` has been written, so new directories are only dispatched
+once their export looks complete: the indexfile has the expected number of
+image rows and hasn't been modified for `settle_time` seconds.
+Wells which fail to image are missing from the indexfile, so an indexfile
+with fewer rows is also accepted once it hasn't been modified for
+`incomplete_timeout` seconds. Directories which still have no usable
+indexfile after `abandon_timeout` seconds are given up on.
+The indexfile is all that image stitching needs, but it only lists the
+images, so the analysis also waits for the other files it reads, see
+`is_analysis_ready()`.
+"""
+
+import glob
+import os
+import time
+from enum import Enum, auto
+from typing import List, Optional
+
+from config import parse_config
+
+cfg_export = parse_config()["export"]
+
+INDEXFILE_NAME = cfg_export["indexfile_name"]
+EXPECTED_INDEXFILE_ROWS = cfg_export.getint("expected_indexfile_rows")
+SETTLE_TIME = cfg_export.getfloat("settle_time")
+INCOMPLETE_TIMEOUT = cfg_export.getfloat("incomplete_timeout")
+ABANDON_TIMEOUT = cfg_export.getfloat("abandon_timeout")
+
+
+class ExportState(Enum):
+    # still being exported, check again later
+    PENDING = auto()
+    # all the expected images are in the indexfile
+    COMPLETE = auto()
+    # the indexfile is missing some images but hasn't changed for a while
+    INCOMPLETE = auto()
+    # no usable indexfile was written in time
+    ABANDONED = auto()
+
+
+def count_indexfile_rows(indexfile_path: str) -> int:
+    """number of image rows in an indexfile, excluding the header"""
+    with open(indexfile_path, "rb") as f:
+        n_lines = sum(1 for line in f if line.strip())
+    return max(n_lines - 1, 0)
+
+
+def parse_required_files(value: str) -> List[str]:
+    """comma-separated glob patterns from a config value"""
+    return [i.strip() for i in value.split(",") if i.strip()]
+
+
+def get_required_files_mtime(
+    plate_dir: str, required_files: List[str]
+) -> Optional[float]:
+    """
+    latest mtime of the files matching the glob patterns in `required_files`,
+    or None if a pattern doesn't match any files
+    """
+    mtime = 0.0
+    for pattern in required_files:
+        paths = glob.glob(os.path.join(glob.escape(plate_dir), pattern))
+        if not paths:
+            return None
+        mtime = max([mtime] + [os.stat(path).st_mtime for path in paths])
+    return mtime
+
+
+def get_export_state(
+    plate_dir: str,
+    first_seen: float,
+    now: Optional[float] = None,
+    indexfile_name: str = INDEXFILE_NAME,
+    expected_rows: int = EXPECTED_INDEXFILE_ROWS,
+    settle_time: float = SETTLE_TIME,
+    incomplete_timeout: float = INCOMPLETE_TIMEOUT,
+    abandon_timeout: float = ABANDON_TIMEOUT,
+) -> ExportState:
+    """
+    whether a plate directory, first seen at `first_seen`, has finished
+    exporting
+    """
+    if now is None:
+        now = time.time()
+    indexfile_path = os.path.join(plate_dir, indexfile_name)
+    try:
+        mtime = os.stat(indexfile_path).st_mtime
+        n_rows = count_indexfile_rows(indexfile_path)
+        # the indexfile could have been written to while it was being read
+        unchanged = os.stat(indexfile_path).st_mtime == mtime
+    except OSError:
+        # not written yet, or a stale handle or permission error on the
+        # network filesystem, either way check again later
+        unchanged = False
+    if unchanged:
+        unmodified_for = now - mtime
+        if n_rows >= expected_rows and unmodified_for >= settle_time:
+            return ExportState.COMPLETE
+        if n_rows > 0 and unmodified_for >= incomplete_timeout:
+            return ExportState.INCOMPLETE
+    if now - first_seen >= abandon_timeout:
+        return ExportState.ABANDONED
+    return ExportState.PENDING
+
+
+def is_analysis_ready(
+    plate_dir: str,
+    required_files: List[str],
+    now: Optional[float] = None,
+    settle_time: float = SETTLE_TIME,
+) -> bool:
+    """
+    whether the files matching each of the glob patterns in `required_files`
+    exist and haven't been modified for `settle_time` seconds
+    """
+    if not required_files:
+        return True
+    if now is None:
+        now = time.time()
+    try:
+        mtime = get_required_files_mtime(plate_dir, required_files)
+    except OSError:
+        return False
+    return mtime is not None and now - mtime >= settle_time
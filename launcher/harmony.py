@@ -0,0 +1,263 @@
+"""
+HTTP client for downloading raw images from the Harmony servers.
+
+Every image URL in an indexfile points at one of a handful of Harmony
+servers, so rather than opening a new connection per image a single pooled
+keep-alive session is created per process and shared by every ImageStitcher
+that runs in that process (i.e across all plates handled by a celery worker).
+
+Downloaded images are also kept in a size-bounded on-disk cache local to the
+node, so retried and re-submitted stitching tasks for recent plates don't
+have to download every image from Harmony again.
+"""
+
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+import threading
+from typing import List, Optional, Tuple
+
+import requests
+from config import parse_config, to_int_tup
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+cfg_stitch = parse_config()["image_stitching"]
+
+MAX_CONNECTIONS_PER_HOST = cfg_stitch.getint("max_connections_per_host")
+HTTP_TIMEOUT = to_int_tup(cfg_stitch["http_timeout"])
+HTTP_RETRIES = cfg_stitch.getint("http_retries")
+HTTP_BACKOFF = cfg_stitch.getfloat("http_backoff")
+IMAGE_CACHE_DIR = cfg_stitch["image_cache_dir"]
+IMAGE_CACHE_MAX_MB = cfg_stitch.getint("image_cache_max_mb")
+IMAGE_CACHE_MAX_DISK_FRACTION = cfg_stitch.getfloat("image_cache_max_disk_fraction")
+IMAGE_CACHE_RESCAN_PUTS = cfg_stitch.getint("image_cache_rescan_puts")
+
+log = logging.getLogger(__name__)
+
+_session: Optional[requests.Session] = None
+_session_pid: Optional[int] = None
+_session_pool_maxsize = 0
+_session_lock = threading.Lock()
+
+
+def create_session(
+    pool_maxsize: int = MAX_CONNECTIONS_PER_HOST,
+    retries: int = HTTP_RETRIES,
+    backoff: float = HTTP_BACKOFF,
+) -> requests.Session:
+    """
+    create a requests session with a keep-alive connection pool for each
+    Harmony server, retrying failed connections and server errors with an
+    exponential backoff.
+    """
+    retry = Retry(
+        total=retries,
+        backoff_factor=backoff,
+        status_forcelist=(500, 502, 503, 504),
+        allowed_methods=frozenset(["GET"]),
+    )
+    adapter = HTTPAdapter(pool_maxsize=pool_maxsize, max_retries=retry)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def get_session(pool_maxsize: int = MAX_CONNECTIONS_PER_HOST) -> requests.Session:
+    """
+    get the session for the current process, creating it on first use.
+    The session is re-created if the process has been forked, so celery
+    worker processes never share sockets with their parent, or if its
+    connection pools are smaller than `pool_maxsize`, otherwise connections
+    beyond the pool size would be discarded rather than kept alive.
+    """
+    global _session, _session_pid, _session_pool_maxsize
+    with _session_lock:
+        if (
+            _session is None
+            or _session_pid != os.getpid()
+            or _session_pool_maxsize < pool_maxsize
+        ):
+            _session = create_session(pool_maxsize)
+            _session_pid = os.getpid()
+            _session_pool_maxsize = pool_maxsize
+        return _session
+
+
+def is_url(path: str) -> bool:
+    """whether an indexfile URL is a remote http(s) URL or a local file path"""
+    return path.startswith(("http://", "https://"))
+
+
+class ImageCache:
+    """
+    On-disk least-recently-used cache of raw image bytes, keyed by the
+    sha256 of the image URL.
+    Files are written atomically so the cache can be shared by every worker
+    process on a node. A file's mtime is updated on each hit, and when the
+    cache grows beyond `max_bytes` the least recently used files are
+    removed until it is back under 90% of that size.
+    Each process only counts the bytes it adds itself, so the size of the
+    whole cache is counted again every `rescan_puts` images, otherwise
+    several worker processes could each fill it to `max_bytes` before any
+    of them evicts. `max_bytes` is also capped at `max_disk_fraction` of
+    the size of the filesystem the cache is on.
+    """
+
+    def __init__(
+        self,
+        cache_dir: str,
+        max_bytes: int,
+        rescan_puts: int = IMAGE_CACHE_RESCAN_PUTS,
+        max_disk_fraction: float = IMAGE_CACHE_MAX_DISK_FRACTION,
+    ):
+        self.cache_dir = cache_dir
+        self.rescan_puts = rescan_puts
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+        disk_bytes = shutil.disk_usage(cache_dir).total
+        self.max_bytes = min(max_bytes, int(max_disk_fraction * disk_bytes))
+        if self.max_bytes < max_bytes:
+            log.info(
+                f"image cache limited to {self.max_bytes / 1024**2:.0f} MB, "
+                f"{max_disk_fraction:.0%} of the disk"
+            )
+        self.puts_since_scan = 0
+        self.size_bytes = self.get_total_bytes()
+
+    def scan(self) -> List[os.DirEntry]:
+        """list cached files, ignoring partially-written temporary files"""
+        return [
+            entry
+            for entry in os.scandir(self.cache_dir)
+            if entry.is_file() and not entry.name.startswith(".")
+        ]
+
+    def get_total_bytes(self) -> int:
+        """size of every cached file, including those added by other processes"""
+        size_bytes = 0
+        for entry in self.scan():
+            try:
+                size_bytes += entry.stat().st_size
+            except FileNotFoundError:
+                # evicted by another process
+                continue
+        return size_bytes
+
+    def path(self, url: str) -> str:
+        key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, key)
+
+    def get(self, url: str) -> Optional[bytes]:
+        """get cached image bytes, or None if the image is not cached"""
+        path = self.path(url)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path)
+        except OSError:
+            # not cached, or evicted by another process
+            data = None
+        with self.lock:
+            if data is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return data
+
+    def put(self, url: str, data: bytes) -> None:
+        """add image bytes to the cache, evicting old images if needed"""
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, prefix=".")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, self.path(url))
+        except OSError as err:
+            log.warning(f"failed to cache image {url}: {err}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+        with self.lock:
+            self.size_bytes += len(data)
+            self.puts_since_scan += 1
+            if self.puts_since_scan >= self.rescan_puts:
+                self.size_bytes = self.get_total_bytes()
+                self.puts_since_scan = 0
+            if self.size_bytes > self.max_bytes:
+                self.evict()
+
+    def evict(self) -> None:
+        """remove least recently used files until under 90% of max_bytes"""
+        entries = []
+        for entry in self.scan():
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+        entries.sort()
+        size_bytes = sum(size for _, size, _ in entries)
+        target_bytes = 0.9 * self.max_bytes
+        for _, size, path in entries:
+            if size_bytes <= target_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            size_bytes -= size
+        self.size_bytes = size_bytes
+        self.puts_since_scan = 0
+
+
+_cache: Optional[ImageCache] = None
+_cache_disabled = IMAGE_CACHE_MAX_MB <= 0
+_cache_lock = threading.Lock()
+
+
+def get_cache() -> Optional[ImageCache]:
+    """
+    get the image cache for the current process, creating it on first use.
+    Returns None if the cache is disabled with `image_cache_max_mb = 0`,
+    or if the cache directory can't be created.
+    """
+    global _cache, _cache_disabled
+    with _cache_lock:
+        if _cache is None and not _cache_disabled:
+            try:
+                _cache = ImageCache(IMAGE_CACHE_DIR, IMAGE_CACHE_MAX_MB * 1024**2)
+            except OSError as err:
+                log.error(f"disabling image cache {IMAGE_CACHE_DIR}: {err}")
+                _cache_disabled = True
+        return _cache
+
+
+def fetch_bytes(
+    url: str,
+    timeout: Tuple[int, int] = HTTP_TIMEOUT,
+    pool_maxsize: int = MAX_CONNECTIONS_PER_HOST,
+) -> bytes:
+    """
+    get the raw bytes of an image, from the image cache if present,
+    otherwise downloaded from Harmony and added to the cache.
+    `pool_maxsize` is the number of concurrent requests the caller makes to
+    each server, see `get_session()`.
+    Raises a `requests.RequestException` (a subclass of OSError) if the
+    image cannot be downloaded after retrying.
+    """
+    cache = get_cache()
+    if cache is not None:
+        data = cache.get(url)
+        if data is not None:
+            return data
+    response = get_session(pool_maxsize).get(url, timeout=timeout)
+    response.raise_for_status()
+    data = response.content
+    if cache is not None:
+        cache.put(url, data)
+    return data
@@ -0,0 +1,157 @@
+"""
+Array operations used by the image stitcher to turn raw Harmony images
+into thumbnails.
+"""
+
+import functools
+from collections import defaultdict
+from typing import List, Optional, Tuple
+
+import numpy as np
+import skimage
+import skimage.transform
+
+
+def resize(img: np.ndarray, size: Tuple[int]) -> np.ndarray:
+    """anti-aliased resize, preserving the range of pixel values"""
+    return skimage.transform.resize(img, size, anti_aliasing=True, preserve_range=True)
+
+
+def downsample_stack(stack: np.ndarray, size: Tuple[int]) -> np.ndarray:
+    """
+    Downsample a stack of equally-sized images with shape (n, height, width)
+    to shape (n, *size) in a single vectorised operation.
+    If the image dimensions are an exact multiple of `size` then this takes
+    the float32 mean of each block of pixels, otherwise it falls back to an
+    anti-aliased resize of the whole stack.
+    """
+    n_images, height, width = stack.shape
+    out_height, out_width = size
+    if height % out_height == 0 and width % out_width == 0:
+        blocks = stack.reshape(
+            n_images, out_height, height // out_height, out_width, width // out_width
+        )
+        return blocks.mean(axis=(2, 4), dtype=np.float32)
+    # a scale factor of 1 along the first axis resizes each image independently
+    return resize(stack, (n_images, out_height, out_width))
+
+
+def downsample_images(
+    imgs: List[np.ndarray], size: Tuple[int], clip_max: Optional[float] = None
+) -> np.ndarray:
+    """
+    Downsample a list of images to a float32 array of shape (n, *size), with
+    images of the same shape downsampled together as one batch.
+    If `clip_max` is given, pixel values are clipped to this maximum before
+    downsampling.
+    """
+    out = np.empty((len(imgs), *size), dtype=np.float32)
+    by_shape = defaultdict(list)
+    for i, img in enumerate(imgs):
+        by_shape[img.shape].append(i)
+    for idx in by_shape.values():
+        stack = np.stack([imgs[i] for i in idx])
+        if clip_max is not None:
+            np.minimum(stack, clip_max, out=stack, casting="unsafe")
+        out[idx] = downsample_stack(stack, size)
+    return out
+
+
+@functools.lru_cache
+def build_lut(max_intensity: int) -> np.ndarray:
+    """
+    Build a lookup table mapping every 16-bit pixel value to its final 8-bit
+    value, i.e the result of dividing by `max_intensity`, clipping at 1 and
+    converting to uint8 with `skimage.img_as_ubyte`.
+    Tables are cached, so each is only built once per process.
+    """
+    values = np.arange(2**16, dtype=np.float64) / max_intensity
+    lut = skimage.img_as_ubyte(np.clip(values, 0.0, 1.0))
+    lut.flags.writeable = False
+    return lut
+
+
+def apply_lut(imgs: np.ndarray, lut: np.ndarray) -> np.ndarray:
+    """
+    Map raw pixel values to 8-bit values with a lookup table from
+    `build_lut()`. Non-integer values from resizing are rounded to the
+    nearest 16-bit value first.
+    """
+    if imgs.dtype != np.uint16:
+        imgs = np.clip(np.rint(imgs), 0, 2**16 - 1).astype(np.uint16)
+    return lut[imgs]
+
+
+def resize_thumbnail(img: np.ndarray, size: Tuple[int], lut: np.ndarray) -> np.ndarray:
+    """
+    Resize a single raw image straight from full size and map it to 8-bit
+    values with a lookup table from `build_lut()`, as the image stitcher
+    originally made every thumbnail.
+    """
+    return apply_lut(resize(img, size), lut)
+
+
+def make_thumbnails(
+    imgs: List[np.ndarray],
+    max_intensity: int,
+    img_size_sample: Tuple[int],
+    img_size_plate_well: Tuple[int],
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Downsample a batch of raw images from a single channel, returning
+    uint8 arrays of sample and plate-well thumbnails.
+    Raw pixel values are clipped at the channel's maximum intensity before
+    downsampling, then mapped to 8-bit values with the channel's lookup
+    table, which is equivalent to rescaling the intensity of the full-size
+    image.
+    The plate-well thumbnails are downsampled from the sample thumbnails
+    so each raw image is only resized once.
+    """
+    lut = build_lut(max_intensity)
+    imgs_sample = downsample_images(imgs, img_size_sample, clip_max=max_intensity)
+    imgs_plate_well = downsample_stack(imgs_sample, img_size_plate_well)
+    return apply_lut(imgs_sample, lut), apply_lut(imgs_plate_well, lut)
+
+
+class MontageLayout:
+    """
+    Geometry of a montage of equally-sized tiles, matching the layout of
+    `skimage.util.montage`: tiles are placed in row-major order on a grid,
+    with `padding_width` pixels of padding around and between every tile.
+    Canvases are allocated once as uint8 and each tile is written straight
+    into its slot, rather than stacking the tiles and copying them into a
+    new montage array.
+    """
+
+    def __init__(
+        self, grid_shape: Tuple[int], tile_shape: Tuple[int], padding_width: int
+    ):
+        self.grid_shape = grid_shape
+        self.tile_shape = tile_shape
+        self.padding_width = padding_width
+        n_rows, n_cols = grid_shape
+        tile_height, tile_width = tile_shape
+        self.shape = (
+            (tile_height + padding_width) * n_rows + padding_width,
+            (tile_width + padding_width) * n_cols + padding_width,
+        )
+
+    def new_canvas(self, n: Optional[int] = None, fill: int = 255) -> np.ndarray:
+        """
+        allocate a canvas filled with the padding value, or a contiguous
+        stack of `n` canvases
+        """
+        shape = self.shape if n is None else (n, *self.shape)
+        return np.full(shape, fill, dtype=np.uint8)
+
+    def slot(self, canvas: np.ndarray, idx: int) -> np.ndarray:
+        """view of the canvas for the tile at position `idx`"""
+        grid_row, grid_col = divmod(idx, self.grid_shape[1])
+        tile_height, tile_width = self.tile_shape
+        top = self.padding_width + (tile_height + self.padding_width) * grid_row
+        left = self.padding_width + (tile_width + self.padding_width) * grid_col
+        return canvas[top : top + tile_height, left : left + tile_width]
+
+    def put(self, canvas: np.ndarray, idx: int, tile: np.ndarray) -> None:
+        """write a tile into its slot on the canvas"""
+        self.slot(canvas, idx)[...] = tile
@@ -0,0 +1,147 @@
+"""
+Compact model of a Phenix indexfile for a 384-well plate.
+
+The stitcher only needs the URL of each well's image in each channel, so
+rather than a DataFrame the indexfile is read in a single pass into a fixed
+(16, 24, n_channels) grid of URLs, with a mask of which images are present
+in the indexfile. Wells which failed to image and are missing from the
+indexfile point at the placeholder image instead.
+"""
+
+import csv
+from typing import Dict, Iterator, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+PLATE_DIMS = (16, 24)
+
+
+class IndexfileRow(NamedTuple):
+    """a single image in the indexfile, positions are 1-indexed"""
+
+    row_num: int
+    col_num: int
+    channel: int
+    url: str
+
+    @property
+    def key(self) -> Tuple[int, int, int]:
+        return self.row_num, self.col_num, self.channel
+
+
+class Indexfile:
+    """
+    Grid of image URLs for each well position and channel of a plate.
+    - `urls[row - 1, col - 1, channel_idx]` is the URL of an image, where
+      `channel_idx` is the position of the channel ID in `channels`.
+    - `present` has the same shape, and is False for images missing from
+      the indexfile, whose URL is the placeholder image path.
+    - `channel_names` maps channel IDs to names, e.g {1: "DAPI"}.
+    """
+
+    def __init__(
+        self,
+        urls: np.ndarray,
+        present: np.ndarray,
+        channels: Tuple[int],
+        channel_names: Dict[int, str],
+    ):
+        self.urls = urls
+        self.present = present
+        self.channels = tuple(channels)
+        self.channel_names = channel_names
+
+    @classmethod
+    def read(
+        cls,
+        path: str,
+        placeholder_path: str,
+        harmony_name_map: Optional[Dict[str, str]] = None,
+        channels: Tuple[int] = (1, 2),
+    ) -> "Indexfile":
+        """
+        Read a tab-separated indexfile, replacing Harmony computer names in
+        URLs with their IP addresses from `harmony_name_map`.
+        """
+        channel_idx = {channel: idx for idx, channel in enumerate(channels)}
+        urls = np.full((*PLATE_DIMS, len(channels)), placeholder_path, dtype=object)
+        present = np.zeros(urls.shape, dtype=bool)
+        channel_names = dict()
+        fix_url = UrlFixer(harmony_name_map or dict())
+        with open(path, newline="") as f:
+            reader = csv.reader(f, delimiter="\t")
+            header = next(reader)
+            col_row, col_col, col_channel, col_name, col_url = (
+                header.index(name)
+                for name in ("Row", "Column", "Channel ID", "Channel Name", "URL")
+            )
+            for fields in reader:
+                if not fields:
+                    continue
+                channel = int(fields[col_channel])
+                if channel not in channel_idx:
+                    continue
+                pos = (
+                    int(fields[col_row]) - 1,
+                    int(fields[col_col]) - 1,
+                    channel_idx[channel],
+                )
+                urls[pos] = fix_url(fields[col_url])
+                present[pos] = True
+                channel_names[channel] = fields[col_name]
+        return cls(urls, present, channels, channel_names)
+
+    def __len__(self) -> int:
+        return self.urls.size
+
+    def get(self, row_num: int, col_num: int, channel: int) -> IndexfileRow:
+        """get the image at a well position and channel"""
+        url = self.urls[row_num - 1, col_num - 1, self.channels.index(channel)]
+        return IndexfileRow(row_num, col_num, channel, url)
+
+    def rows(self, channel: Optional[int] = None) -> Iterator[IndexfileRow]:
+        """
+        iterate over images ordered by row, column and then channel,
+        optionally only those from a single channel
+        """
+        channels = self.channels if channel is None else (channel,)
+        n_rows, n_cols = PLATE_DIMS
+        for row_num in range(1, n_rows + 1):
+            for col_num in range(1, n_cols + 1):
+                for channel_id in channels:
+                    yield self.get(row_num, col_num, channel_id)
+
+    def is_present(self, row: IndexfileRow) -> bool:
+        """whether an image is in the indexfile, rather than a placeholder"""
+        idx = self.channels.index(row.channel)
+        return bool(self.present[row.row_num - 1, row.col_num - 1, idx])
+
+    def channel_name(self, channel: int) -> str:
+        return self.channel_names.get(channel, str(channel))
+
+
+class UrlFixer:
+    """
+    Replaces Harmony computer names in URLs with IP addresses, where the
+    result is cached for each distinct URL prefix up to the path, as every
+    image on a plate comes from one of a handful of servers.
+    """
+
+    def __init__(self, name_map: Dict[str, str]):
+        self.name_map = name_map
+        self.prefixes: Dict[str, str] = dict()
+
+    def __call__(self, url: str) -> str:
+        scheme, sep, rest = url.partition("://")
+        if not sep:
+            return self.replace(url)
+        host, slash, path = rest.partition("/")
+        prefix = f"{scheme}{sep}{host}"
+        if prefix not in self.prefixes:
+            self.prefixes[prefix] = self.replace(prefix)
+        return f"{self.prefixes[prefix]}{slash}{path}"
+
+    def replace(self, text: str) -> str:
+        for name, ip_address in self.name_map.items():
+            text = text.replace(name, ip_address)
+        return text
@@ -0,0 +1,115 @@
+"""
+Per-plate manifest of stitched outputs.
+
+The manifest is saved as `manifest.json` in a plate's output directory and
+records the hash of the indexfile and the stitching parameters used, along
+with a hash of the inputs and a checksum of each output. When a plate is
+stitched again only the outputs whose inputs or parameters have changed, or
+whose files are missing, need to be regenerated.
+It also records the images which couldn't be loaded and were replaced by the
+placeholder, so they can be repaired later without stitching everything.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+from typing import Dict, Iterable, List, Optional
+
+MANIFEST_NAME = "manifest.json"
+MANIFEST_VERSION = 1
+
+log = logging.getLogger(__name__)
+
+
+def sha256_file(path: str) -> str:
+    """sha256 hex digest of a file's contents"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(2**20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def hash_inputs(inputs: Iterable) -> str:
+    """sha256 hex digest of an iterable of json-serialisable inputs"""
+    digest = hashlib.sha256()
+    for item in inputs:
+        digest.update(json.dumps(item, sort_keys=True).encode("utf-8"))
+    return digest.hexdigest()
+
+
+class Manifest:
+    """
+    Outputs recorded for a plate, loaded from `output_dir` if a manifest
+    already exists there.
+    Each output is recorded by name (e.g "well_A01", "plate_1") with the
+    hash of its inputs, the file it was saved to and the file's checksum.
+    Images which couldn't be loaded are recorded in `missing_images` as
+    [row, column, channel ID] lists.
+    A manifest that can't be read, or which was made with different
+    parameters, is treated as empty so everything is regenerated.
+    """
+
+    def __init__(self, output_dir: str, indexfile_sha256: str, params: Dict):
+        self.path = os.path.join(output_dir, MANIFEST_NAME)
+        self.output_dir = output_dir
+        self.indexfile_sha256 = indexfile_sha256
+        self.params = params
+        self.outputs: Dict[str, Dict] = {}
+        self.missing_images: List[List[int]] = []
+        # whether the recorded outputs were made from this indexfile
+        self.same_indexfile = False
+        previous = self.load()
+        if previous is not None and previous.get("params") == params:
+            self.outputs = previous.get("outputs", {})
+            self.missing_images = previous.get("missing_images", [])
+            self.same_indexfile = previous["indexfile_sha256"] == indexfile_sha256
+
+    def load(self) -> Optional[Dict]:
+        try:
+            with open(self.path) as f:
+                manifest = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as err:
+            log.warning(f"ignoring unreadable manifest {self.path}: {err}")
+            return None
+        if manifest.get("version") != MANIFEST_VERSION:
+            return None
+        return manifest
+
+    def is_current(self, name: str, inputs_sha256: str) -> bool:
+        """
+        whether an output was made from the same inputs and parameters, and
+        its file still exists
+        """
+        entry = self.outputs.get(name)
+        if entry is None or entry["inputs"] != inputs_sha256:
+            return False
+        return os.path.exists(os.path.join(self.output_dir, entry["file"]))
+
+    def record(self, name: str, inputs_sha256: str, file: str, sha256: str) -> None:
+        self.outputs[name] = {"inputs": inputs_sha256, "file": file, "sha256": sha256}
+
+    def discard(self, name: str) -> None:
+        self.outputs.pop(name, None)
+
+    def save(self) -> None:
+        """atomically write the manifest to the output directory"""
+        manifest = {
+            "version": MANIFEST_VERSION,
+            "indexfile_sha256": self.indexfile_sha256,
+            "params": self.params,
+            "outputs": self.outputs,
+            "missing_images": self.missing_images,
+        }
+        fd, tmp_path = tempfile.mkstemp(dir=self.output_dir, prefix=".")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(manifest, f, indent=2, sort_keys=True)
+            os.replace(tmp_path, self.path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
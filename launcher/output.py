@@ -0,0 +1,306 @@
+"""
+Saving stitched images.
+
+Encoding PNGs and writing them to the CAMP mount is slow compared to
+stitching, so images are handed to a small pool of writer threads and saved
+in the background while the next images are being stitched.
+
+The image format and encoder settings are chosen with a compression profile,
+trading encoding time against file size. The "png" profile produces the
+same files as `skimage.io.imsave`.
+
+Rather than one file per image, a plate's images can also be saved into a
+single uncompressed zip container with a JSON index giving the byte range of
+every image, so readers can fetch a single well with one seek and read.
+"""
+
+import hashlib
+import io
+import json
+import os
+import threading
+import zipfile
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import PIL.Image
+from config import parse_config
+
+cfg_stitch = parse_config()["image_stitching"]
+
+N_WRITERS = cfg_stitch.getint("n_writers")
+
+# Pillow format name, file extension and encoder settings
+COMPRESSION_PROFILES = {
+    "png": {"format": "PNG", "extension": "png", "params": {"compress_level": 6}},
+    "png-fast": {
+        "format": "PNG",
+        "extension": "png",
+        "params": {"compress_level": 1},
+    },
+    "png-small": {
+        "format": "PNG",
+        "extension": "png",
+        "params": {"compress_level": 9, "optimize": True},
+    },
+    "webp-lossless": {
+        "format": "WEBP",
+        "extension": "webp",
+        "params": {"lossless": True, "quality": 50, "method": 4},
+    },
+}
+COMPRESSION_PROFILE = cfg_stitch["compression_profile"]
+OUTPUT_MODES = ("files", "container")
+OUTPUT_MODE = cfg_stitch["output_mode"]
+CONTAINER_NAME = "stitched.zip"
+CONTAINER_INDEX = "index.json"
+
+
+def get_profile(name: str) -> Dict:
+    """get compression profile by name"""
+    try:
+        return COMPRESSION_PROFILES[name]
+    except KeyError:
+        raise ValueError(
+            f"unknown compression profile '{name}', "
+            f"expected one of {list(COMPRESSION_PROFILES)}"
+        ) from None
+
+
+def decode_image(data: bytes) -> np.ndarray:
+    """decode a saved image as 8-bit greyscale"""
+    img = PIL.Image.open(io.BytesIO(data))
+    return np.array(img.convert("L"))
+
+
+def encode_image(arr: np.ndarray, profile: Dict) -> bytes:
+    """encode an 8-bit image with a compression profile"""
+    buffer = io.BytesIO()
+    PIL.Image.fromarray(arr).save(buffer, format=profile["format"], **profile["params"])
+    return buffer.getvalue()
+
+
+class ImageWriter:
+    """
+    Saves images to an output directory using a bounded pool of writer
+    threads, encoded with the given compression profile. Filenames are
+    given without an extension, which is set by the profile.
+    Each image is copied when it's submitted, so the caller is free to re-use
+    the array straight away. At most 2 * `n_writers` images are queued at a
+    time, after which `write()` blocks until a writer is free, to keep
+    memory bounded.
+    Any write error is raised from the next call to `write()` or from
+    `close()`, which waits for all pending writes to finish. If `n_writers`
+    is 0 then images are saved synchronously.
+    """
+
+    def __init__(
+        self,
+        output_dir: str,
+        n_writers: int = N_WRITERS,
+        compression_profile: str = COMPRESSION_PROFILE,
+    ):
+        self.output_dir = output_dir
+        self.n_writers = n_writers
+        self.profile = get_profile(compression_profile)
+        self.executor = ThreadPoolExecutor(n_writers) if n_writers > 0 else None
+        self.slots = threading.BoundedSemaphore(2 * max(n_writers, 1))
+        self.futures: List[Future] = []
+        self.error: Optional[BaseException] = None
+        # file name and sha256 of everything saved, by key
+        self.written: Dict[str, Tuple[str, str]] = {}
+
+    def write(self, filename: str, arr: np.ndarray) -> None:
+        """save an image to the output directory"""
+        if self.executor is None:
+            self.save(filename, arr)
+            return
+        if self.error is not None:
+            raise self.error
+        self.slots.acquire()
+        future = self.executor.submit(self.save, filename, arr.copy())
+        future.add_done_callback(self.on_done)
+        self.futures.append(future)
+
+    def on_done(self, future: Future) -> None:
+        self.slots.release()
+        if future.exception() is not None and self.error is None:
+            self.error = future.exception()
+
+    def save(self, filename: str, arr: np.ndarray) -> None:
+        data = encode_image(arr, self.profile)
+        name = f"{filename}.{self.profile['extension']}"
+        self.store(filename, name, data, arr.shape)
+
+    def path(self, filename: str) -> str:
+        """path an image is saved to, `filename` is without an extension"""
+        return os.path.join(self.output_dir, f"{filename}.{self.profile['extension']}")
+
+    def read(self, filename: str) -> np.ndarray:
+        """read a previously saved image, `filename` is without an extension"""
+        with open(self.path(filename), "rb") as f:
+            return decode_image(f.read())
+
+    def write_bytes(self, name: str, data: bytes) -> None:
+        """save an already-encoded file, `name` includes the file extension"""
+        self.store(name, name, data, shape=None)
+
+    def store(self, key: str, name: str, data: bytes, shape: Optional[tuple]) -> None:
+        """write a file, `key` is the name used to look it up in containers"""
+        path = os.path.join(self.output_dir, name)
+        if "/" in name:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(data)
+        self.written[key] = (name, hashlib.sha256(data).hexdigest())
+
+    def close(self) -> None:
+        """wait for all pending writes, raising the first write error"""
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+        for future in self.futures:
+            future.result()
+        self.futures = []
+
+
+class ContainerWriter(ImageWriter):
+    """
+    Saves a plate's images into a single zip container in the output
+    directory rather than as separate files.
+    Images are already compressed so are stored without zip compression,
+    and an index is written as the last entry, mapping each image name to
+    its shape and the byte offset and length of the encoded image within
+    the container. The container is written to a temporary file, created
+    by the first write, and only moved into place by `close()` once every
+    image has been saved. Images in an existing container which weren't
+    saved again are copied across, and if nothing was saved the existing
+    container is left as it is.
+    """
+
+    def __init__(
+        self,
+        output_dir: str,
+        n_writers: int = N_WRITERS,
+        compression_profile: str = COMPRESSION_PROFILE,
+        container_name: str = CONTAINER_NAME,
+    ):
+        super().__init__(output_dir, n_writers, compression_profile)
+        self.container_name = container_name
+        self.container_path = os.path.join(output_dir, container_name)
+        self.tmp_path = os.path.join(output_dir, f".{container_name}.tmp")
+        self.zip_file: Optional[zipfile.ZipFile] = None
+        self.zip_lock = threading.Lock()
+        self.index: Dict[str, Dict] = {}
+
+    def store(self, key: str, name: str, data: bytes, shape: Optional[tuple]) -> None:
+        with self.zip_lock:
+            self.add_entry(key, name, data, shape)
+        self.written[key] = (self.container_name, hashlib.sha256(data).hexdigest())
+
+    def add_entry(
+        self, key: str, name: str, data: bytes, shape: Optional[tuple]
+    ) -> None:
+        """add a file to the temporary container, holding `self.zip_lock`"""
+        if self.zip_file is None:
+            self.zip_file = zipfile.ZipFile(self.tmp_path, "w", zipfile.ZIP_STORED)
+        self.zip_file.writestr(name, data)
+        info = self.zip_file.getinfo(name)
+        # fixed-size local file header, followed by the name and extra field
+        offset = info.header_offset + 30 + len(info.filename.encode()) + len(info.extra)
+        self.index[key] = {
+            "file": name,
+            "offset": offset,
+            "length": len(data),
+            "shape": None if shape is None else list(shape),
+        }
+
+    def copy_existing(self) -> None:
+        """
+        copy images which weren't saved again from the existing container,
+        holding `self.zip_lock`
+        """
+        if not os.path.exists(self.container_path):
+            return
+        reader = ContainerReader(self.container_path)
+        for key in reader.names():
+            if key not in self.index:
+                entry = reader.index[key]
+                data = reader.read_bytes(key)
+                self.add_entry(key, entry["file"], data, entry["shape"])
+
+    def read(self, filename: str) -> np.ndarray:
+        """read an image from the previously saved container"""
+        return ContainerReader(self.container_path).read(filename)
+
+    def close(self) -> None:
+        """
+        wait for all pending writes, then write the index and move the
+        container into place, raising the first write error
+        """
+        try:
+            super().close()
+            with self.zip_lock:
+                if self.zip_file is None:
+                    return
+                self.copy_existing()
+                self.zip_file.writestr(CONTAINER_INDEX, json.dumps(self.index))
+                self.zip_file.close()
+            os.replace(self.tmp_path, self.container_path)
+        finally:
+            if self.zip_file is not None:
+                self.zip_file.close()
+            if os.path.exists(self.tmp_path):
+                os.remove(self.tmp_path)
+
+
+def create_writer(
+    output_dir: str,
+    output_mode: str = OUTPUT_MODE,
+    n_writers: int = N_WRITERS,
+    compression_profile: str = COMPRESSION_PROFILE,
+) -> ImageWriter:
+    """create a writer for either separate image files or a container"""
+    if output_mode == "files":
+        return ImageWriter(output_dir, n_writers, compression_profile)
+    if output_mode == "container":
+        return ContainerWriter(output_dir, n_writers, compression_profile)
+    raise ValueError(
+        f"unknown output mode '{output_mode}', expected one of {OUTPUT_MODES}"
+    )
+
+
+class ContainerReader:
+    """
+    Reads individual images from a plate container written by
+    `ContainerWriter`.
+    Only the index is read when the container is opened, each image is then
+    read with a single seek to its byte range, without decompressing or
+    scanning the rest of the container.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with zipfile.ZipFile(path) as zip_file:
+            self.index = json.loads(zip_file.read(CONTAINER_INDEX))
+
+    def names(self) -> List[str]:
+        """
+        names of the entries in the container, images are named without
+        their file extension
+        """
+        return sorted(self.index)
+
+    def read_bytes(self, name: str) -> bytes:
+        """get the encoded bytes of an image"""
+        try:
+            entry = self.index[name]
+        except KeyError:
+            raise KeyError(f"no image '{name}' in {self.path}") from None
+        with open(self.path, "rb") as f:
+            f.seek(entry["offset"])
+            return f.read(entry["length"])
+
+    def read(self, name: str) -> np.ndarray:
+        """get a decoded 8-bit image"""
+        return decode_image(self.read_bytes(name))
@@ -0,0 +1,68 @@
+"""
+DeepZoom tile pyramids of whole-plate montages.
+
+A pyramid is made up of levels, where the highest level is the full-size
+montage and each level below is half the size of the level above, down to a
+single pixel at level 0. Every level is cut into square tiles, so a viewer
+only has to load the tiles it is currently displaying at its current zoom.
+This follows the DeepZoom layout used by OpenSeadragon, a `<name>.dzi`
+descriptor alongside `<name>_files/<level>/<column>_<row>.<format>` tiles.
+"""
+
+import math
+from typing import Iterator, Tuple
+
+import numpy as np
+
+DZI_TEMPLATE = (
+    '<?xml version="1.0" encoding="UTF-8"?>\n'
+    '<Image xmlns="http://schemas.microsoft.com/deepzoom/2008" '
+    'Format="{format}" Overlap="0" TileSize="{tile_size}">\n'
+    '  <Size Width="{width}" Height="{height}"/>\n'
+    "</Image>\n"
+)
+
+
+def n_levels(shape: Tuple[int]) -> int:
+    """number of levels in the pyramid of an image"""
+    return math.ceil(math.log2(max(shape))) + 1
+
+
+def halve(img: np.ndarray) -> np.ndarray:
+    """
+    downsample a uint8 image by 2 along each axis with a 2x2 block mean,
+    odd-sized images are padded by repeating their last row or column
+    """
+    height, width = img.shape
+    img = np.pad(img, ((0, height % 2), (0, width % 2)), mode="edge")
+    blocks = img.reshape(img.shape[0] // 2, 2, img.shape[1] // 2, 2)
+    return ((blocks.sum(axis=(1, 3), dtype=np.uint16) + 2) // 4).astype(np.uint8)
+
+
+def iter_levels(img: np.ndarray) -> Iterator[Tuple[int, np.ndarray]]:
+    """yield (level, image) for each level of the pyramid, largest first"""
+    for level in reversed(range(n_levels(img.shape))):
+        yield level, img
+        if level > 0:
+            img = halve(img)
+
+
+def iter_tiles(
+    img: np.ndarray, tile_size: int
+) -> Iterator[Tuple[int, int, np.ndarray]]:
+    """
+    yield (column, row, tile) views of an image, tiles on the bottom and
+    right edges are cropped to the size of the image
+    """
+    height, width = img.shape
+    for row, top in enumerate(range(0, height, tile_size)):
+        for col, left in enumerate(range(0, width, tile_size)):
+            yield col, row, img[top : top + tile_size, left : left + tile_size]
+
+
+def dzi_descriptor(shape: Tuple[int], tile_size: int, fmt: str) -> str:
+    """DeepZoom XML descriptor for the pyramid of an image"""
+    height, width = shape
+    return DZI_TEMPLATE.format(
+        format=fmt, tile_size=tile_size, width=width, height=height
+    )
@@ -0,0 +1,19 @@
+"""
+Queue repair tasks for stitched plates, re-fetching only the images which
+were missing when each plate was stitched.
+
+usage: python repair.py /path/to/indexfile.txt [/path/to/indexfile.txt ...]
+"""
+
+import sys
+
+import task
+
+
+def main():
+    for indexfile_path in sys.argv[1:]:
+        task.background_image_stitch_repair_384.delay(indexfile_path)
+
+
+if __name__ == "__main__":
+    main()
@@ -8,6 +8,9 @@ def main():
     new_plates = dispatch.get_new_directories()
     for plate in new_plates:
         dispatch.dispatch_plate(plate)
+    # plates already stitched, whose analysis was waiting on other files
+    for plate in dispatch.get_analysis_ready_directories():
+        dispatch.dispatch_plate(plate, stitching=False)
 
 
 if __name__ == "__main__":
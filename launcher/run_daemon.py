@@ -0,0 +1,108 @@
+"""
+Long-running alternative to running `run.py` and `run_titration.py` from
+cron every 5 minutes.
+
+A `Dispatcher`, with its database engine and snapshot, is kept alive for
+each of the neutralisation and titration results directories, and new plates
+are dispatched as soon as their results directory changes, see
+`watcher.DirectoryWatcher`, rather than on the next cron run. Each check
+runs in a new database transaction, so it sees tasks finished by the
+workers since the last check.
+"""
+
+import logging
+import signal
+import threading
+
+from config import parse_config
+from dispatch import Dispatcher
+from export import parse_required_files
+from watcher import DirectoryWatcher
+
+cfg = parse_config()
+
+log = logging.getLogger(__name__)
+
+
+def watch(dispatcher: Dispatcher, watcher: DirectoryWatcher, stop: threading.Event):
+    """dispatch new plates each time the results directory may have changed"""
+    while not stop.is_set():
+        # errors are logged rather than stopping the daemon, as a cron run
+        # would have failed on its own
+        try:
+            new_plates = dispatcher.get_new_directories()
+            # already stitched, their analysis was waiting on other files
+            analysis_plates = dispatcher.get_analysis_ready_directories()
+        except Exception:
+            log.exception(f"failed to check {dispatcher.results_dir}")
+            new_plates = []
+            analysis_plates = []
+        plates = [(plate, True) for plate in new_plates]
+        plates += [(plate, False) for plate in analysis_plates]
+        for plate, stitching in plates:
+            try:
+                dispatcher.dispatch_plate(plate, stitching=stitching)
+            except Exception:
+                log.exception(f"failed to dispatch {plate}")
+                dispatcher.database.session.rollback()
+        # the session lives as long as the daemon, so end its transaction
+        # and clear its identity map before waiting, otherwise the next
+        # check could see stale stitching and analysis states
+        dispatcher.database.session.close()
+        if dispatcher.has_pending():
+            # files written inside a plate directory don't modify the results
+            # directory, so check exports and analysis files in progress
+            # again soon
+            stop.wait(watcher.poll_min_interval)
+        else:
+            watcher.wait(changed=bool(new_plates), stop=stop)
+
+
+def run_watcher(section: str, stop: threading.Event):
+    """watch the results directory from a config section, until `stop` is set"""
+    cfg_section = cfg[section]
+    try:
+        # the snapshot database connection has to be made in this thread
+        dispatcher = Dispatcher(
+            results_dir=cfg_section["results_dir"],
+            db_path=cfg_section["snapshot_db"],
+            full_scan_interval=cfg_section.getint("snapshot_full_scan_interval"),
+            analysis_required_files=parse_required_files(
+                cfg_section["analysis_required_files"]
+            ),
+        )
+        watcher = DirectoryWatcher(dispatcher.results_dir)
+    except Exception:
+        log.exception(f"failed to start watching [{section}] results_dir")
+        stop.set()
+        raise
+    try:
+        watch(dispatcher, watcher, stop)
+    finally:
+        watcher.close()
+
+
+def main():
+    stop = threading.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda signum, frame: stop.set())
+    threads = [
+        threading.Thread(target=run_watcher, args=(section, stop), name=section)
+        for section in ("analysis", "titration")
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        # join with a timeout so signals are handled in the main thread
+        while thread.is_alive():
+            thread.join(1)
+    log.info("stopped")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        filename=cfg["watch"]["log_path"],
+        level=logging.INFO,
+        format="%(asctime)s: %(levelname)s: %(name)s: %(threadName)s: %(message)s",
+    )
+    main()
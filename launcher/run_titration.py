@@ -2,19 +2,29 @@ import logging
 
 from config import parse_config
 from dispatch import Dispatcher
+from export import parse_required_files
 
 cfg_titration = parse_config()["titration"]
 RESULTS_DIR = cfg_titration["results_dir"]
 SNAPSHOT_DB_PATH = cfg_titration["snapshot_db"]
+SNAPSHOT_FULL_SCAN_INTERVAL = cfg_titration.getint("snapshot_full_scan_interval")
+ANALYSIS_REQUIRED_FILES = parse_required_files(cfg_titration["analysis_required_files"])
 LOGNAME = cfg_titration["log_path"]
 
 
 def main():
     # save again for titration directory
-    dispatch_titration = Dispatcher(results_dir=RESULTS_DIR, db_path=SNAPSHOT_DB_PATH)
+    dispatch_titration = Dispatcher(
+        results_dir=RESULTS_DIR,
+        db_path=SNAPSHOT_DB_PATH,
+        full_scan_interval=SNAPSHOT_FULL_SCAN_INTERVAL,
+        analysis_required_files=ANALYSIS_REQUIRED_FILES,
+    )
     new_titration_plates = dispatch_titration.get_new_directories()
     for titration_plate in new_titration_plates:
         dispatch_titration.dispatch_plate(titration_plate)
+    for titration_plate in dispatch_titration.get_analysis_ready_directories():
+        dispatch_titration.dispatch_plate(titration_plate, stitching=False)
 
 
 if __name__ == "__main__":
@@ -12,15 +12,18 @@ An example workflow:
     results_dir = "/mnt/proj-c19/ABNEUTRALISATION/NA_raw_data"
 
     snapshot = Snapshot(results_dir)
-    if snapshot.current_hash == snapshot.stored_hash:
-        # nothing has changed
+    # list the directory once, for hashing, diffing and saving
+    cycle = snapshot.cycle()
+    if cycle.is_unchanged:
+        # nothing has changed, record when the directory was checked
+        cycle.record_scan()
         sys.exit(0)
 
     # get new directory names
-    new_data = snapshot.get_new_dirs()
+    new_data = cycle.get_new_dirs()
 
     # record new snapshot
-    snapshot.make_snapshot()
+    cycle.save()
 
     # do stuff with new_data
     ...
@@ -31,7 +34,32 @@ import hashlib
 import os
 import sqlite3
 import re
-from typing import List, Optional
+import time
+from typing import List, NamedTuple, Optional, Tuple
+
+# seconds, directory timestamps on some filesystems are only this precise
+MTIME_GRANULARITY = 2
+
+
+class DirStat(NamedTuple):
+    """
+    modification time, inode change time and inode number of a directory,
+    along with when they were read
+    """
+
+    mtime_ns: int
+    ctime_ns: int
+    inode: int
+    scanned_at: float
+
+    @classmethod
+    def from_path(cls, path: str) -> "DirStat":
+        stat = os.stat(path)
+        return cls(stat.st_mtime_ns, stat.st_ctime_ns, stat.st_ino, time.time())
+
+    def same_as(self, other: "DirStat") -> bool:
+        """whether the directory is unmodified between two stats"""
+        return self[:3] == other[:3]
 
 
 class SnapshotDB:
@@ -47,6 +75,8 @@ class SnapshotDB:
 
     def create_connection(self):
         con = sqlite3.connect(self.db_path)
+        # write-ahead logging, so saving a snapshot doesn't block readers
+        con.execute("PRAGMA journal_mode=WAL")
         # create db if it doesn't exist
         with con:
             con.executescript(
@@ -58,6 +88,21 @@ class SnapshotDB:
                     id INTEGER PRIMARY KEY,
                     value TEXT
                 );
+                CREATE TABLE IF NOT EXISTS dir_stat(
+                    id INTEGER PRIMARY KEY,
+                    mtime_ns INTEGER,
+                    ctime_ns INTEGER,
+                    inode INTEGER,
+                    scanned_at REAL
+                );
+                CREATE TABLE IF NOT EXISTS pending(
+                    id PRIMARY KEY,
+                    first_seen REAL
+                );
+                CREATE TABLE IF NOT EXISTS awaiting_analysis(
+                    id PRIMARY KEY,
+                    first_seen REAL
+                );
                 """
             )
         return con
@@ -90,12 +135,134 @@ class SnapshotDB:
     def create_snapshot(self, dirnames: List[str]):
         self.add_dirs(dirnames)
 
-    def add_hash(self, hash_val: str):
+    def diff(self, dirnames: List[str]) -> Tuple[List[str], List[str]]:
+        """
+        Compare directory names against the stored snapshot, returning the
+        sorted (new, removed) directory names.
+        The names are loaded into a temporary table and compared with one
+        set-based query each way, rather than looking up every name.
+        """
+        rows = [(i,) for i in dirnames]
+        with self.con:
+            self.con.execute("CREATE TEMP TABLE IF NOT EXISTS listing(id PRIMARY KEY)")
+            self.con.execute("DELETE FROM listing")
+            self.con.executemany("INSERT OR IGNORE INTO listing(id) VALUES(?)", rows)
+            new_dirs = self.con.execute(
+                "SELECT id FROM listing EXCEPT SELECT id FROM snapshot ORDER BY id"
+            ).fetchall()
+            removed_dirs = self.con.execute(
+                "SELECT id FROM snapshot EXCEPT SELECT id FROM listing ORDER BY id"
+            ).fetchall()
+            self.con.execute("DELETE FROM listing")
+        return [i for (i,) in new_dirs], [i for (i,) in removed_dirs]
+
+    def apply_delta(
+        self,
+        new_dirs: List[str],
+        removed_dirs: List[str],
+        hash_val: str,
+        dir_stat: Optional[DirStat] = None,
+        pending: bool = False,
+    ):
+        """
+        update the stored snapshot with only the new and removed directory
+        names from `self.diff()`, along with the new hash and the parent
+        directory's stat if given, in one transaction.
+        If `pending` is True new directories are also added to the pending
+        directories, see `self.get_pending()`.
+        """
         with self.con:
-            self.con.execute("UPDATE hash SET VALUE=? WHERE id=1", (hash_val,))
-            self.con.execute(
-                "INSERT OR IGNORE INTO hash (id, value) VALUES (1, ?)", (hash_val,)
+            self.con.executemany(
+                "INSERT OR IGNORE INTO snapshot(id) VALUES(?)", [(i,) for i in new_dirs]
+            )
+            self.con.executemany(
+                "DELETE FROM snapshot WHERE id = ?", [(i,) for i in removed_dirs]
             )
+            self.con.executemany(
+                "DELETE FROM pending WHERE id = ?", [(i,) for i in removed_dirs]
+            )
+            self.con.executemany(
+                "DELETE FROM awaiting_analysis WHERE id = ?",
+                [(i,) for i in removed_dirs],
+            )
+            if pending:
+                now = time.time()
+                self.con.executemany(
+                    "INSERT OR IGNORE INTO pending(id, first_seen) VALUES(?, ?)",
+                    [(i, now) for i in new_dirs],
+                )
+            self.set_hash(hash_val)
+            if dir_stat is not None:
+                self.set_dir_stat(dir_stat)
+
+    def get_pending(self) -> List[Tuple[str, float]]:
+        """
+        (directory name, time first seen) of new directories which are
+        still being waited on, oldest first
+        """
+        return self.con.execute(
+            "SELECT id, first_seen FROM pending ORDER BY first_seen, id"
+        ).fetchall()
+
+    def rm_pending(self, dirnames: List[str]):
+        with self.con:
+            self.con.executemany(
+                "DELETE FROM pending WHERE id = ?", [(i,) for i in dirnames]
+            )
+
+    def add_awaiting_analysis(self, dirnames: List[str]):
+        """
+        record directories which have finished exporting, but whose analysis
+        is waiting on other files, see `self.get_awaiting_analysis()`
+        """
+        now = time.time()
+        with self.con:
+            self.con.executemany(
+                "INSERT OR IGNORE INTO awaiting_analysis(id, first_seen) VALUES(?, ?)",
+                [(i, now) for i in dirnames],
+            )
+
+    def get_awaiting_analysis(self) -> List[Tuple[str, float]]:
+        """
+        (directory name, time first seen) of directories whose analysis is
+        still being waited on, oldest first
+        """
+        return self.con.execute(
+            "SELECT id, first_seen FROM awaiting_analysis ORDER BY first_seen, id"
+        ).fetchall()
+
+    def rm_awaiting_analysis(self, dirnames: List[str]):
+        with self.con:
+            self.con.executemany(
+                "DELETE FROM awaiting_analysis WHERE id = ?", [(i,) for i in dirnames]
+            )
+
+    def add_hash(self, hash_val: str):
+        with self.con:
+            self.set_hash(hash_val)
+
+    def set_hash(self, hash_val: str):
+        """set the hash, within the caller's transaction"""
+        self.con.execute("UPDATE hash SET VALUE=? WHERE id=1", (hash_val,))
+        self.con.execute(
+            "INSERT OR IGNORE INTO hash (id, value) VALUES (1, ?)", (hash_val,)
+        )
+
+    def add_dir_stat(self, dir_stat: DirStat):
+        with self.con:
+            self.set_dir_stat(dir_stat)
+
+    def set_dir_stat(self, dir_stat: DirStat):
+        """set the parent directory's stat, within the caller's transaction"""
+        self.con.execute(
+            "INSERT OR REPLACE INTO dir_stat VALUES (1, ?, ?, ?, ?)", tuple(dir_stat)
+        )
+
+    def get_dir_stat(self) -> Optional[DirStat]:
+        row = self.con.execute(
+            "SELECT mtime_ns, ctime_ns, inode, scanned_at FROM dir_stat WHERE id=1"
+        ).fetchone()
+        return DirStat(*row) if row else None
 
     def get_hash(self) -> Optional[str]:
         cur = self.con.cursor()
@@ -105,6 +272,90 @@ class SnapshotDB:
         return val[0] if val else None
 
 
+def hash_dirnames(dirnames: List[str]) -> str:
+    """hash of a sorted list of directory names"""
+    filenames_utf8 = " ".join(dirnames).encode("utf-8")
+    return hashlib.sha256(filenames_utf8).hexdigest()
+
+
+class SnapshotCycle:
+    """
+    A single listing of a snapshot's parent directory, which is reused for
+    hashing, finding new directories and saving the next snapshot, so the
+    directory is only listed once per cycle. On a slow mount with thousands
+    of directories each listing can take seconds.
+    If `scan` is False the parent directory is known to be unmodified since
+    the stored snapshot, so it isn't listed at all, see
+    `Snapshot.is_unmodified()`.
+    """
+
+    def __init__(
+        self,
+        snapshot: "Snapshot",
+        dir_stat: Optional[DirStat] = None,
+        scan: bool = True,
+    ):
+        self.snapshot = snapshot
+        self.dir_stat = dir_stat
+        self.scan = scan
+        if scan:
+            self.dirnames = snapshot.get_all_dirnames()
+            self.current_hash = hash_dirnames(self.dirnames)
+        else:
+            self.dirnames = None
+            self.current_hash = snapshot.stored_hash
+        self.delta: Optional[Tuple[List[str], List[str]]] = None
+
+    @property
+    def is_unchanged(self) -> bool:
+        """whether the directory contents match the stored snapshot"""
+        return self.current_hash == self.snapshot.stored_hash
+
+    def get_delta(self) -> Tuple[List[str], List[str]]:
+        """
+        (new, removed) directory names compared to the stored snapshot,
+        see `SnapshotDB.diff()`, only queried once per cycle
+        """
+        if not self.scan:
+            return [], []
+        if self.delta is None:
+            self.delta = self.snapshot.db.diff(self.dirnames)
+        return self.delta
+
+    def get_new_dirs(self) -> List[str]:
+        """full paths of directories which are not in the stored snapshot"""
+        new_dirs, _ = self.get_delta()
+        return [os.path.join(self.snapshot.parent_dir, i) for i in new_dirs]
+
+    def save(self, fresh=True):
+        """
+        record this listing as the new snapshot by saving only its
+        difference from the stored snapshot, if `fresh` is False then
+        directories which have been removed are kept in the snapshot
+        """
+        if not self.scan:
+            return
+        new_dirs, removed_dirs = self.get_delta()
+        if not fresh:
+            removed_dirs = []
+        self.snapshot.db.apply_delta(
+            new_dirs,
+            removed_dirs,
+            self.current_hash,
+            self.dir_stat,
+            pending=self.snapshot.track_pending,
+        )
+        self.delta = None
+
+    def record_scan(self):
+        """
+        record the parent directory's stat when its contents are unchanged,
+        so following cycles can skip listing it
+        """
+        if self.scan and self.dir_stat is not None:
+            self.snapshot.db.add_dir_stat(self.dir_stat)
+
+
 class Snapshot:
     """Class to create and interact with a directory snapshot."""
 
@@ -113,40 +364,62 @@ class Snapshot:
         parent_dir: str,
         db_path=".snapshot.db",
         regex=r"^[S|T].*/*Measurement [0-9]$",
+        full_scan_interval: float = 0,
+        track_pending: bool = False,
     ):
         self.parent_dir = parent_dir
         self.regex = re.compile(regex) if regex else None
         self.db = SnapshotDB(db_path)
+        # seconds between full listings, 0 to list the directory every cycle
+        self.full_scan_interval = full_scan_interval
+        # also record new directories as pending when a cycle is saved, so
+        # they can be followed until they are ready to use
+        self.track_pending = track_pending
 
     @property
     def current_hash(self) -> str:
-        base_filenames = self.get_all_dirnames()
-        filenames_utf8 = " ".join(base_filenames).encode("utf-8")
-        return hashlib.sha256(filenames_utf8).hexdigest()
+        return hash_dirnames(self.get_all_dirnames())
 
     @property
     def stored_hash(self) -> Optional[str]:
         return self.db.get_hash()
 
     def get_all_dirnames(self) -> List[str]:
-        filenames = os.listdir(self.parent_dir)
+        with os.scandir(self.parent_dir) as entries:
+            filenames = [entry.name for entry in entries]
         if self.regex:
             filenames = list(filter(self.regex.search, filenames))
-        base_filenames = [os.path.basename(i) for i in filenames]
-        return sorted(base_filenames)
+        return sorted(filenames)
+
+    def cycle(self) -> SnapshotCycle:
+        """
+        list the parent directory once, see `SnapshotCycle`, unless it is
+        unmodified since the stored snapshot
+        """
+        dir_stat = DirStat.from_path(self.parent_dir)
+        return SnapshotCycle(self, dir_stat, scan=not self.is_unmodified(dir_stat))
+
+    def is_unmodified(self, dir_stat: DirStat) -> bool:
+        """
+        Whether the parent directory's mtime, ctime and inode are the same
+        as when the stored snapshot was listed, so there's no need to list
+        it again.
+        It is listed anyway every `self.full_scan_interval` seconds, in case
+        NFS attribute caching hides a change, and if it was modified within
+        `MTIME_GRANULARITY` seconds of the last listing, as then coarse
+        timestamps can't show whether that listing included the change.
+        """
+        if self.full_scan_interval <= 0:
+            return False
+        stored = self.db.get_dir_stat()
+        if stored is None or not dir_stat.same_as(stored):
+            return False
+        if dir_stat.scanned_at - stored.scanned_at >= self.full_scan_interval:
+            return False
+        return stored.scanned_at - stored.mtime_ns / 1e9 > MTIME_GRANULARITY
 
     def make_snapshot(self, fresh=True):
-        dirnames = self.get_all_dirnames()
-        if fresh:
-            self.db.drop_snapshot()
-        self.db.create_snapshot(dirnames)
-        self.db.add_hash(self.current_hash)
+        self.cycle().save(fresh)
 
     def get_new_dirs(self) -> List[str]:
-        new_dirs = []
-        all_dirs = self.get_all_dirnames()
-        for dirname in all_dirs:
-            if self.db.is_new_dir(dirname):
-                full_dir_path = os.path.join(self.parent_dir, dirname)
-                new_dirs.append(full_dir_path)
-        return new_dirs
+        return self.cycle().get_new_dirs()
@@ -1,18 +1,36 @@
+import functools
+import io
 import itertools
+import logging
 import os
+import threading
 import urllib.error
-from collections import defaultdict
-from typing import Dict, List, Tuple
+import urllib.parse
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
 
 import numpy as np
-import pandas as pd
 import skimage
 import skimage.io
-import skimage.transform
 import utils
+from checkpoint import CHECKPOINT_DIR, CHECKPOINT_INTERVAL, Checkpoint
 from config import parse_config, to_int_tup
+from harmony import fetch_bytes, get_cache, is_url
+from image_ops import MontageLayout, build_lut, make_thumbnails, resize_thumbnail
+from indexfile import Indexfile, IndexfileRow
+from manifest import Manifest, hash_inputs, sha256_file
+from output import (
+    COMPRESSION_PROFILE,
+    N_WRITERS,
+    OUTPUT_MODE,
+    create_writer,
+    get_profile,
+)
+from pyramid import dzi_descriptor, iter_levels, iter_tiles
 from well_dict import well_dict as WELL_DICT
 
+log = logging.getLogger(__name__)
 cfg = parse_config()
 cfg_stitch = cfg["image_stitching"]
 
@@ -26,8 +44,43 @@ IMG_SIZE_SAMPLE = to_int_tup(cfg_stitch["img_size_sample"])
 IMG_SIZE_PLATE_WELL = to_int_tup(cfg_stitch["img_size_plate_well"])
 CHANNELS = to_int_tup(cfg_stitch["channels"])
 DILUTIONS = to_int_tup(cfg_stitch["dilutions"])
+MAX_CONNECTIONS_PER_HOST = cfg_stitch.getint("max_connections_per_host")
+RESIZE_BATCH_SIZE = cfg_stitch.getint("resize_batch_size")
+STREAMING = cfg_stitch.getboolean("streaming")
+TILE_PYRAMID = cfg_stitch.getboolean("tile_pyramid")
+PYRAMID_TILE_SIZE = cfg_stitch.getint("pyramid_tile_size")
+SKIP_UNCHANGED = cfg_stitch.getboolean("skip_unchanged")
+TITRATION_SAMPLES = cfg_stitch.getboolean("titration_samples")
 PLATE_DIMS = (16, 24)
 SAMPLE_DIMS = (2, 4)
+PLATE_PADDING = 3
+SAMPLE_PADDING = 10
+WELL_96_INDEX = {well: idx for idx, well in enumerate(WELL_DICT)}
+
+
+@functools.lru_cache
+def read_placeholder(path: str) -> np.ndarray:
+    """read and decode the missing well placeholder image, once per process"""
+    img = skimage.io.imread(path, as_gray=True)
+    img.flags.writeable = False
+    return img
+
+
+@functools.lru_cache
+def get_placeholder_thumbnails(
+    path: str,
+    max_intensity: int,
+    img_size_sample: Tuple[int],
+    img_size_plate_well: Tuple[int],
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    sample and plate-well thumbnails of the missing well placeholder image,
+    made once per process for each set of stitching parameters
+    """
+    imgs_sample, imgs_plate_well = make_thumbnails(
+        [read_placeholder(path)], max_intensity, img_size_sample, img_size_plate_well
+    )
+    return imgs_sample[0], imgs_plate_well[0]
 
 
 class ImageStitcher:
@@ -58,240 +111,493 @@ class ImageStitcher:
         missing_well_img_path: str = MISSING_WELL_IMG,
         img_size_sample: Tuple[int] = IMG_SIZE_SAMPLE,
         img_size_plate_well: Tuple[int] = IMG_SIZE_PLATE_WELL,
+        max_connections_per_host: int = MAX_CONNECTIONS_PER_HOST,
+        resize_batch_size: int = RESIZE_BATCH_SIZE,
+        streaming: bool = STREAMING,
+        n_writers: int = N_WRITERS,
+        compression_profile: str = COMPRESSION_PROFILE,
+        output_mode: str = OUTPUT_MODE,
+        tile_pyramid: bool = TILE_PYRAMID,
+        pyramid_tile_size: int = PYRAMID_TILE_SIZE,
+        skip_unchanged: bool = SKIP_UNCHANGED,
+        checkpoint_dir: str = CHECKPOINT_DIR,
+        checkpoint_interval: int = CHECKPOINT_INTERVAL,
     ):
         self.indexfile_path = indexfile_path
         self.missing_well_img_path = missing_well_img_path
         self.harmony_name_map = harmony_name_map
-        indexfile = pd.read_csv(indexfile_path, sep="\t")
-        self.indexfile = self.fix_indexfile(indexfile)
+        self.indexfile = Indexfile.read(
+            indexfile_path, missing_well_img_path, harmony_name_map, CHANNELS
+        )
         self.output_dir = output_dir
         self.plate_images = None
         self.dilution_images = None
+        self.img_store = None
+        self.exact_img_store = None
         self.max_intensity_channel = {1: max_dapi, 2: max_alexa488}
+        # map raw 16-bit pixel values straight to the final 8-bit values
+        self.channel_luts = {
+            channel: build_lut(max_intensity)
+            for channel, max_intensity in self.max_intensity_channel.items()
+        }
         self.img_size_sample = img_size_sample
         self.img_size_plate_well = img_size_plate_well
+        self.plate_layout = MontageLayout(
+            PLATE_DIMS, img_size_plate_well, PLATE_PADDING
+        )
+        self.sample_layout = MontageLayout(SAMPLE_DIMS, img_size_sample, SAMPLE_PADDING)
+        # full-resolution plate montage for the tile pyramid, with the plate
+        # padding scaled up to match the sample-size thumbnails
+        pyramid_padding = round(
+            PLATE_PADDING * img_size_sample[0] / img_size_plate_well[0]
+        )
+        self.pyramid_layout = MontageLayout(
+            PLATE_DIMS, img_size_sample, pyramid_padding
+        )
+        self.max_connections_per_host = max_connections_per_host
+        self.resize_batch_size = resize_batch_size
+        self.streaming = streaming
+        self.n_writers = n_writers
+        self.compression_profile = compression_profile
+        self.output_mode = output_mode
+        self.tile_pyramid = tile_pyramid
+        self.pyramid_tile_size = pyramid_tile_size
+        self.skip_unchanged = skip_unchanged
+        self.checkpoint_dir = checkpoint_dir
+        self.checkpoint_interval = checkpoint_interval
+        self.checkpoint = None
+        self.manifest = None
+        self.output_inputs: Dict[str, str] = {}
+        # outputs to regenerate, None for all of them
+        self.stale_outputs: Optional[Set[str]] = None
+        self.writer = None
         # these are present in the indexfile, can't be loaded
         self.missing_images = []
-
-    def fix_missing_wells(self, indexfile: pd.DataFrame) -> pd.DataFrame:
-        """
-        find missing wells in the indexfile and add
-        them in with the URL pointing to a placeholder
-        """
-        n_expected_rows = 768  # 384 wells * 2 channels
-        if indexfile.shape[0] == n_expected_rows:
-            # no missing wells, just return the indexfile as it is
-            return indexfile
-        # create a dataframe with complete "Row", "Column", "Channel ID" column values
-        rows, cols = zip(*itertools.product(range(1, 17), range(1, 25)))
-        temp_df_1 = pd.DataFrame({"Row": rows, "Column": cols, "Channel ID": 1})
-        temp_df_2 = pd.DataFrame({"Row": rows, "Column": cols, "Channel ID": 2})
-        temp_df = pd.concat([temp_df_1, temp_df_2]).sort_values(
-            ["Row", "Column", "Channel ID"]
-        )
-        merged = indexfile.merge(temp_df, how="outer")
-        assert merged.shape[0] == n_expected_rows
-        # replace missing URLs with the placeholder URL
-        merged["URL"] = merged["URL"].fillna(self.missing_well_img_path)
-        merged = merged.sort_values(["Row", "Column", "Channel ID"])
-        return merged
-
-    def fix_urls(self, df: pd.DataFrame) -> pd.DataFrame:
-        # not a regex, but needed for pandas substring replacement
-        df.URL = df.URL.replace(self.harmony_name_map, regex=True)
-        return df
-
-    def fix_indexfile(self, indexfile: pd.DataFrame) -> pd.DataFrame:
-        """
-        replace missing wells with placeholder image, and replace
-        computer names with ip addresses
-        """
-        indexfile = self.fix_urls(indexfile)
-        indexfile = self.fix_missing_wells(indexfile)
-        return indexfile
+        self.peak_rss_mb = None
 
     def stitch_plate(self) -> None:
         """stitch well images into a plate montage"""
-        ch_images = defaultdict(list)
-        plate_images = dict()
-        for channel, group in self.indexfile.groupby("Channel ID"):
-            for _, row in group.iterrows():
-                img = self.load_img(row)
-                img = skimage.transform.resize(
-                    img,
-                    self.img_size_plate_well,
-                    anti_aliasing=True,
-                    preserve_range=True,
-                )
-                ch_images[channel].append(img)
-            img_stack = np.stack(ch_images[channel])
-            img_plate = img_stack.reshape(384, *self.img_size_plate_well)
-            # rescale intensity
-            img_plate /= self.max_intensity_channel[channel]
-            img_plate[img_plate > 1.0] = 1.0
-            img_plate = skimage.img_as_float(img_plate)
-            img_montage = skimage.util.montage(
-                img_plate,
-                fill=1.0,
-                padding_width=3,
-                grid_shape=PLATE_DIMS,
-                rescale_intensity=False,
-            )
-            plate_images[channel] = img_montage
-        self.plate_images = plate_images
+        img_store = self.create_exact_img_store(samples=False)
+        self.plate_images = {
+            channel: img_store["plate"][channel_idx]
+            for channel_idx, channel in enumerate(CHANNELS)
+        }
 
     def stitch_sample(self, well: str) -> np.ndarray:
-        """stitch individual sample"""
-        df = self.indexfile.copy()
-        sample_dict = defaultdict(dict)
-        images = []
-        # as we're dealing with the 96-well labels, but the indexfile is using
-        # the original 384-well labels, we need to get the 4 384-well labels
-        # which correspond to the given sample well label
-        wells_384 = WELL_DICT[well]
-        for well_384 in wells_384:
-            row, column = utils.well_to_row_col(well_384)
-            # subset dataframe to just correct row/columns
-            df_subset = df[(df["Row"] == row) & (df["Column"] == column)]
-            for channel_name, group in df_subset.groupby("Channel ID"):
-                for _, group_row in group.iterrows():
-                    dilution = utils.get_dilution_from_row_col(
-                        group_row["Row"], group_row["Column"]
-                    )
-                    img = self.load_img(group_row)
-                    sample_dict[channel_name].update({dilution: img})
-        for channel in CHANNELS:
-            for dilution in DILUTIONS:
-                img = sample_dict[channel][dilution]
-                img = skimage.transform.resize(
-                    img, self.img_size_sample, anti_aliasing=True, preserve_range=True
-                )
-                # rescale image intensities
-                img /= self.max_intensity_channel[channel]
-                img[img > 1.0] = 1
-                img = skimage.img_as_float(img)
-                images.append(img)
-        img_stack = np.stack(images).reshape(8, *self.img_size_sample)
-        img_montage = skimage.util.montage(
-            arr_in=img_stack,
-            fill=1.0,  # white if rescale_intensity is True
-            grid_shape=SAMPLE_DIMS,
-            rescale_intensity=False,
-            padding_width=10,
-        )
+        """
+        stitch individual sample, taken from the shared image store if the
+        samples of the whole plate have already been stitched, otherwise
+        only this sample's images are loaded
+        """
+        if self.exact_img_store is not None and "sample" in self.exact_img_store:
+            return self.exact_img_store["sample"][WELL_96_INDEX[well]].copy()
+        img_montage = self.sample_layout.new_canvas()
+        for row, img in self.load_imgs(self.get_sample_rows(well)):
+            img_sample, _ = self.resize_thumbnails(img, row.channel, plate=False)
+            self.sample_layout.put(
+                img_montage, self.get_exact_sample_idx(row), img_sample
+            )
         return img_montage
 
     def stitch_all_samples(self):
         """stitch but don't save sample images"""
-        dilution_images = {}
-        for well in WELL_DICT.keys():
-            sample_img = self.stitch_sample(well)
-            dilution_images[well] = sample_img
-        self.dilution_images = dilution_images
+        img_store = self.create_exact_img_store(plate=False)
+        self.dilution_images = {
+            well: img_store["sample"][well_idx]
+            for well, well_idx in WELL_96_INDEX.items()
+        }
+
+    def create_exact_img_store(
+        self, plate: bool = True, samples: bool = True
+    ) -> Dict[str, np.ndarray]:
+        """
+        Image store for `self.stitch_plate()`, `self.stitch_sample()` and
+        `self.stitch_all_samples()`, laid out like `self.img_store` but
+        without tile pyramids.
+        Every image is loaded and resized separately from its full-size
+        image to each thumbnail size, which keeps the results of these
+        methods the same as they have always been, see
+        `self.resize_thumbnails()`. Sample montages keep their original
+        dilution order, see `self.get_exact_sample_idx()`.
+        Only the plate montages and sample montages which are asked for are
+        made, each the first time it is needed and then shared, so asking
+        for both at once only loads each image once.
+        """
+        if self.exact_img_store is None:
+            self.exact_img_store = dict()
+        plate = plate and "plate" not in self.exact_img_store
+        samples = samples and "sample" not in self.exact_img_store
+        if not plate and not samples:
+            return self.exact_img_store
+        sample_store = (
+            self.sample_layout.new_canvas(len(WELL_96_INDEX)) if samples else None
+        )
+        plate_store = self.plate_layout.new_canvas(len(CHANNELS)) if plate else None
+        for channel_idx, channel in enumerate(CHANNELS):
+            for row, img in self.load_imgs(self.indexfile.rows(channel)):
+                img_sample, img_plate_well = self.resize_thumbnails(
+                    img, channel, sample=samples, plate=plate
+                )
+                well_96, _, plate_idx = self.get_slots(row)
+                if samples:
+                    self.sample_layout.put(
+                        sample_store[WELL_96_INDEX[well_96]],
+                        self.get_exact_sample_idx(row),
+                        img_sample,
+                    )
+                if plate:
+                    self.plate_layout.put(
+                        plate_store[channel_idx], plate_idx, img_plate_well
+                    )
+        if samples:
+            self.exact_img_store["sample"] = sample_store
+        if plate:
+            self.exact_img_store["plate"] = plate_store
+        return self.exact_img_store
+
+    def resize_thumbnails(
+        self,
+        img: Optional[np.ndarray],
+        channel: int,
+        sample: bool = True,
+        plate: bool = True,
+    ) -> Tuple[Optional[np.ndarray], Optional[np.ndarray]]:
+        """
+        Resize a raw image, or the placeholder if `img` is None, to the
+        sample and plate-well thumbnail sizes separately with an anti-aliased
+        resize, see `image_ops.resize_thumbnail()`. The sample thumbnail is
+        None if `sample` is False, and the plate-well thumbnail is None if
+        `plate` is False.
+        """
+        if img is None:
+            img = read_placeholder(self.missing_well_img_path)
+        lut = self.channel_luts[channel]
+        img_sample = (
+            resize_thumbnail(img, self.img_size_sample, lut) if sample else None
+        )
+        img_plate_well = (
+            resize_thumbnail(img, self.img_size_plate_well, lut) if plate else None
+        )
+        return img_sample, img_plate_well
+
+    @staticmethod
+    def get_exact_sample_idx(row: IndexfileRow) -> int:
+        """
+        position of an indexfile row's image in a sample montage made by
+        `self.stitch_sample()`, which orders each channel's images by
+        increasing dilution rather than by `utils.dilution_from_well()`
+        """
+        dilution = utils.get_dilution_from_row_col(row.row_num, row.col_num)
+        return CHANNELS.index(row.channel) * len(DILUTIONS) + DILUTIONS.index(dilution)
 
     def create_img_store(self) -> None:
         """
         This loads all images from an indexfile, and stores the resized
-        and intensity-scaled images in a dictionary. The images are stored
-        twice for the plate images and the sample images, as they require
-        different sizes for each.
+        and intensity-scaled images straight into preallocated uint8 montage
+        canvases, one for each sample and one for each plate channel.
+        Images are processed per channel in batches of
+        `self.resize_batch_size`, see `self.make_thumbnails()`, and each
+        thumbnail is written into its montage slot as soon as it is made.
         The image store is stored in the class as `self.img_store`.
         ---
         img_store:
         {
-            "sample": {
-                "A01": {
-                    1: {1: np.ndarray, 2: np.ndarray, 3:np.ndarray, 4:np.ndarray},
-                    2: {1: np.ndarray, 2: np.ndarray, 3:np.ndarray, 4:np.ndarray},
-                },
-                ...
-                "H12": {
-                    1: {1: np.ndarray, 2: np.ndarray, 3:np.ndarray, 4:np.ndarray},
-                    2: {1: np.ndarray, 2: np.ndarray, 3:np.ndarray, 4:np.ndarray},
-                },
-            },
-            "plate": {1: list[np.ndarray], 2: list[np.ndarray]}
+            # sample montages indexed by WELL_96_INDEX, e.g
+            # img_store["sample"][WELL_96_INDEX["A01"]] is the A01 montage
+            "sample": np.ndarray(shape=(96, *self.sample_layout.shape)),
+            # plate montages indexed by channel position in CHANNELS
+            "plate": np.ndarray(shape=(2, *self.plate_layout.shape)),
+            # full-resolution plate montages for the tile pyramids, or None
+            # if `self.tile_pyramid` is False
+            "pyramid": np.ndarray(shape=(2, *self.pyramid_layout.shape)),
         }
         """
-        sample_dict = defaultdict(lambda: defaultdict(dict))
-        plate_dict = defaultdict(list)
-        for _, row in self.indexfile.iterrows():
-            img = self.load_img(row)
-            well_384 = utils.row_col_to_well(int(row["Row"]), int(row["Column"]))
-            dilution = utils.dilution_from_well(well_384)
-            well_96 = utils.convert_well_384_to_96(well_384)
-            channel = int(row["Channel ID"])
-            img = self.rescale_intensity(img, channel)
-            img_resized_plate_well = skimage.transform.resize(
-                img, self.img_size_plate_well, anti_aliasing=True, preserve_range=True
+        sample_store = self.sample_layout.new_canvas(len(WELL_96_INDEX))
+        plate_store = self.plate_layout.new_canvas(len(CHANNELS))
+        pyramid_store = self.new_pyramid_store()
+        for channel_idx, channel in enumerate(CHANNELS):
+            rows = self.indexfile.rows(channel)
+            for batch in utils.batched(self.load_imgs(rows), self.resize_batch_size):
+                batch_rows, imgs = zip(*batch)
+                imgs_sample, imgs_plate_well = self.make_thumbnails(
+                    batch_rows, imgs, channel
+                )
+                for row, img_sample, img_plate_well in zip(
+                    batch_rows, imgs_sample, imgs_plate_well
+                ):
+                    well_96, sample_idx, plate_idx = self.get_slots(row)
+                    self.sample_layout.put(
+                        sample_store[WELL_96_INDEX[well_96]], sample_idx, img_sample
+                    )
+                    self.plate_layout.put(
+                        plate_store[channel_idx], plate_idx, img_plate_well
+                    )
+                    if pyramid_store is not None:
+                        self.pyramid_layout.put(
+                            pyramid_store[channel_idx], plate_idx, img_sample
+                        )
+        self.img_store = {
+            "sample": sample_store,
+            "plate": plate_store,
+            "pyramid": pyramid_store,
+        }
+
+    def new_pyramid_store(self) -> Optional[np.ndarray]:
+        """
+        allocate full-resolution plate montages for the tile pyramids, one
+        per channel, or None if tile pyramids are not enabled
+        """
+        if not self.tile_pyramid:
+            return None
+        return self.pyramid_layout.new_canvas(len(CHANNELS))
+
+    def get_slots(self, row: IndexfileRow) -> Tuple[str, int, int]:
+        """
+        Get the 96-well sample label for an indexfile row, along with the
+        positions of its image in the sample montage and the plate montage.
+        Sample montages have a row per channel and a column per dilution.
+        """
+        row_num, col_num, channel = row.key
+        channel_idx = CHANNELS.index(channel)
+        well_384 = utils.row_col_to_well(row_num, col_num)
+        dilution = utils.dilution_from_well(well_384)
+        well_96 = utils.convert_well_384_to_96(well_384)
+        sample_idx = channel_idx * len(DILUTIONS) + (dilution - 1)
+        plate_idx = (row_num - 1) * PLATE_DIMS[1] + (col_num - 1)
+        return well_96, sample_idx, plate_idx
+
+    def get_rows_by_sample(self) -> Dict[str, List[IndexfileRow]]:
+        """
+        Group indexfile rows by 96-well sample, in sample order.
+        Each sample's rows are ordered by channel.
+        """
+        return {well_96: self.get_sample_rows(well_96) for well_96 in WELL_DICT}
+
+    def get_sample_rows(self, well_96: str) -> List[IndexfileRow]:
+        """indexfile rows of a 96-well sample, ordered by channel"""
+        return [
+            self.indexfile.get(*utils.well_to_row_col(well_384), channel)
+            for channel in CHANNELS
+            for well_384 in WELL_DICT[well_96]
+        ]
+
+    def stream_samples_and_plates(self) -> None:
+        """
+        Stitch and save each sample as soon as its images are loaded, working
+        through the indexfile in 96-well sample order.
+        Only the current sample montage and the plate montages are kept in
+        memory, plate images and tile pyramids are saved once every sample
+        is done. Images for upcoming samples are still fetched concurrently.
+        """
+        plate_store = self.plate_layout.new_canvas(len(CHANNELS))
+        pyramid_store = self.new_pyramid_store()
+        sample_montage = self.sample_layout.new_canvas()
+        rows_by_sample = self.get_rows_by_sample()
+        if not any(self.is_stale(f"plate_{channel}") for channel in CHANNELS):
+            # plates are up to date, so only load images for stale samples
+            rows_by_sample = {
+                well_96: sample_rows
+                for well_96, sample_rows in rows_by_sample.items()
+                if self.is_stale(f"well_{well_96}")
+            }
+        all_rows = itertools.chain.from_iterable(rows_by_sample.values())
+        loaded = self.load_imgs(all_rows)
+        for well_96, sample_rows in rows_by_sample.items():
+            sample_montage.fill(255)
+            sample_imgs = itertools.islice(loaded, len(sample_rows))
+            by_channel = itertools.groupby(
+                sample_imgs, key=lambda row_img: row_img[0].channel
             )
-            img_resized_sample = skimage.transform.resize(
-                img, self.img_size_sample, anti_aliasing=True, preserve_range=True
+            for channel, channel_imgs in by_channel:
+                channel_rows, imgs = zip(*channel_imgs)
+                imgs_sample, imgs_plate_well = self.make_thumbnails(
+                    channel_rows, imgs, channel
+                )
+                channel_idx = CHANNELS.index(channel)
+                for row, img_sample, img_plate_well in zip(
+                    channel_rows, imgs_sample, imgs_plate_well
+                ):
+                    _, sample_idx, plate_idx = self.get_slots(row)
+                    self.sample_layout.put(sample_montage, sample_idx, img_sample)
+                    self.plate_layout.put(
+                        plate_store[channel_idx], plate_idx, img_plate_well
+                    )
+                    if pyramid_store is not None:
+                        self.pyramid_layout.put(
+                            pyramid_store[channel_idx], plate_idx, img_sample
+                        )
+            if self.is_stale(f"well_{well_96}"):
+                self.save_image(f"well_{well_96}", sample_montage)
+        for channel_idx, channel_num in enumerate(CHANNELS):
+            if not self.is_stale(f"plate_{channel_num}"):
+                continue
+            self.save_image(f"plate_{channel_num}", plate_store[channel_idx])
+            if pyramid_store is not None:
+                self.save_pyramid(channel_num, pyramid_store[channel_idx])
+
+    def make_thumbnails(
+        self,
+        rows: List[IndexfileRow],
+        imgs: List[Optional[np.ndarray]],
+        channel: int,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Make uint8 sample and plate-well thumbnails from a batch of indexfile
+        rows and their raw images from a single channel, see
+        `image_ops.make_thumbnails()`.
+        Thumbnails saved in `self.checkpoint` are re-used, new thumbnails
+        are added to it. Other missing images (None) use the cached
+        placeholder thumbnails rather than being resized.
+        """
+        max_intensity = self.max_intensity_channel[channel]
+        imgs_sample = np.empty((len(imgs), *self.img_size_sample), dtype=np.uint8)
+        imgs_plate_well = np.empty(
+            (len(imgs), *self.img_size_plate_well), dtype=np.uint8
+        )
+        checkpointed = set()
+        if self.checkpoint is not None:
+            for idx, row in enumerate(rows):
+                saved = self.checkpoint.get(row.key)
+                if saved is not None:
+                    imgs_sample[idx], imgs_plate_well[idx] = saved
+                    checkpointed.add(idx)
+        present = [idx for idx, img in enumerate(imgs) if img is not None]
+        missing = [
+            idx
+            for idx, img in enumerate(imgs)
+            if img is None and idx not in checkpointed
+        ]
+        if present:
+            imgs_sample[present], imgs_plate_well[present] = make_thumbnails(
+                [imgs[idx] for idx in present],
+                max_intensity,
+                self.img_size_sample,
+                self.img_size_plate_well,
             )
-            sample_dict[well_96][channel][dilution] = img_resized_sample
-            plate_dict[channel].append(img_resized_plate_well)
-        self.img_store = {"sample": sample_dict, "plate": plate_dict}
+            if self.checkpoint is not None:
+                for idx in present:
+                    self.checkpoint.add(
+                        rows[idx].key,
+                        imgs_sample[idx],
+                        imgs_plate_well[idx],
+                    )
+        if missing:
+            (
+                imgs_sample[missing],
+                imgs_plate_well[missing],
+            ) = self.get_placeholder_thumbnails(channel)
+        return imgs_sample, imgs_plate_well
+
+    def get_placeholder_thumbnails(self, channel: int) -> Tuple[np.ndarray, np.ndarray]:
+        """get cached sample and plate-well thumbnails of the placeholder image"""
+        return get_placeholder_thumbnails(
+            self.missing_well_img_path,
+            self.max_intensity_channel[channel],
+            tuple(self.img_size_sample),
+            tuple(self.img_size_plate_well),
+        )
 
-    def load_img(self, row: pd.Series):
+    def fetch_img(self, row: IndexfileRow) -> Optional[np.ndarray]:
         """
-        Load image from indexfile row.
-        If the image is missing then load the placeholder image and add
-        row to self.missing_images.
+        Fetch and decode image from indexfile row.
+        Remote images are downloaded through the shared keep-alive Harmony
+        session and decoded from memory.
+        Returns None for wells missing from the indexfile which point at the
+        placeholder image, without reading it, and for rows whose
+        thumbnails are already saved in `self.checkpoint`. If the image is
+        missing then this also returns None and adds the row to
+        self.missing_images.
         """
+        if not self.indexfile.is_present(row):
+            return None
+        if self.checkpoint is not None and self.checkpoint.get(row.key) is not None:
+            return None
+        url = row.url
         try:
-            img = skimage.io.imread(row["URL"], as_gray=True)
+            if is_url(url):
+                data = fetch_bytes(
+                    url, pool_maxsize=max(self.max_connections_per_host, 1)
+                )
+                img = skimage.io.imread(io.BytesIO(data), as_gray=True)
+            else:
+                img = skimage.io.imread(url, as_gray=True)
         except (urllib.error.HTTPError, OSError):
             self.missing_images.append(row)
-            img = skimage.io.imread(self.missing_well_img_path, as_gray=True)
+            img = None
         return img
 
-    def rescale_intensity(self, img: np.ndarray, channel: int) -> np.ndarray:
-        """rescale image intensity, clip values to 1 over this limit"""
-        img = img.astype(np.float64)
-        img /= self.max_intensity_channel[channel]
-        img[img > 1.0] = 1.0
-        img = skimage.img_as_float(img)
-        return img
+    def load_imgs(
+        self, rows: Iterable[IndexfileRow]
+    ) -> Iterator[Tuple[IndexfileRow, Optional[np.ndarray]]]:
+        """
+        Fetch images from indexfile rows, yielding `(row, img)` tuples in the
+        same order as `rows`, where `img` is None if the placeholder image
+        should be used instead, see `self.fetch_img()`.
+        If `self.max_connections_per_host` is greater than 1 then images are
+        fetched concurrently in a thread pool, with at most that many requests
+        in-flight to each Harmony server at a time. Only a small window of
+        images is fetched ahead of the consumer to keep memory bounded.
+        """
+        rows = list(rows)
+        if self.max_connections_per_host <= 1:
+            for row in rows:
+                yield row, self.fetch_img(row)
+            return
+        # local files and placeholder rows aren't limited, they don't make
+        # any requests to a Harmony server
+        host_limits = {
+            self.get_host(row.url): threading.BoundedSemaphore(
+                self.max_connections_per_host
+            )
+            for row in rows
+            if is_url(row.url)
+        }
+
+        def fetch(row: IndexfileRow) -> Optional[np.ndarray]:
+            if not is_url(row.url):
+                return self.fetch_img(row)
+            with host_limits[self.get_host(row.url)]:
+                return self.fetch_img(row)
+
+        n_workers = self.max_connections_per_host * max(len(host_limits), 1)
+        executor = ThreadPoolExecutor(max_workers=n_workers)
+        pending = deque()
+        try:
+            for row in rows:
+                pending.append((row, executor.submit(fetch, row)))
+                if len(pending) >= 2 * n_workers:
+                    next_row, future = pending.popleft()
+                    yield next_row, future.result()
+            while pending:
+                next_row, future = pending.popleft()
+                yield next_row, future.result()
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    @staticmethod
+    def get_host(url: str) -> str:
+        """get host from an image URL, local file paths have an empty host"""
+        return urllib.parse.urlsplit(url).netloc
 
     def stitch_and_save_plates(self):
-        # stitch and save plates images
-        for channel_num in CHANNELS:
-            img_stack_plate = np.stack(self.img_store["plate"][channel_num])
-            img_montage_plate = skimage.util.montage(
-                img_stack_plate,
-                fill=1.0,
-                padding_width=3,
-                grid_shape=PLATE_DIMS,
-                rescale_intensity=False,
-            )
-            plate_path = os.path.join(self.output_dir_path, f"plate_{channel_num}.png")
-            img_montage_plate = np.clip(img_montage_plate, -1, 1)
-            plate_arr = skimage.img_as_ubyte(img_montage_plate)
-            skimage.io.imsave(fname=plate_path, arr=plate_arr)
+        # save plate images, already stitched by create_img_store()
+        for channel_idx, channel_num in enumerate(CHANNELS):
+            if not self.is_stale(f"plate_{channel_num}"):
+                continue
+            plate_arr = self.img_store["plate"][channel_idx]
+            self.save_image(f"plate_{channel_num}", plate_arr)
+            if self.img_store["pyramid"] is not None:
+                self.save_pyramid(channel_num, self.img_store["pyramid"][channel_idx])
 
     def stitch_and_save_samples(self):
-        # stitch and save sample images
-        for well in WELL_DICT.keys():
-            sample_well = self.img_store["sample"][well]
-            sample_imgs = []
-            for channel in CHANNELS:
-                for dilution in [1, 2, 3, 4]:
-                    img = sample_well[channel][dilution]
-                    sample_imgs.append(img)
-            sample_stack = np.stack(sample_imgs)
-            sample_montage = skimage.util.montage(
-                arr_in=sample_stack,
-                fill=1.0,  # white if rescale_intensity is True
-                grid_shape=SAMPLE_DIMS,
-                rescale_intensity=False,
-                padding_width=10,
-            )
-            sample_montage = np.clip(sample_montage, -1, 1)
-            sample_montage = skimage.img_as_ubyte(sample_montage)
-            well_path = os.path.join(self.output_dir_path, f"well_{well}.png")
-            skimage.io.imsave(fname=well_path, arr=sample_montage)
+        # save sample images, already stitched by create_img_store()
+        for well, well_idx in WELL_96_INDEX.items():
+            if not self.is_stale(f"well_{well}"):
+                continue
+            sample_montage = self.img_store["sample"][well_idx]
+            self.save_image(f"well_{well}", sample_montage)
 
-    def stitch_and_save_all_samples_and_plates(self):
+    def stitch_and_save_all_samples_and_plates(self, samples: bool = True):
         """
         Stitch all samples and build up whole 384-well plate image as we go,
         this saves loading each image from Harmony twice per standard
@@ -299,41 +605,339 @@ class ImageStitcher:
         This saves the stitched images immediately after they are stitched
         rather than storing them in `self.dilution_images` and
         `self.plate_images` to reduce memory usage.
+        If `self.streaming` is True then each sample is saved as soon as its
+        images are loaded, otherwise every image is loaded into
+        `self.img_store` first.
+        Images are saved in the background by `self.writer`, this waits for
+        every image to be written before returning.
+        If `self.skip_unchanged` is True then only outputs which are missing
+        or out of date according to the plate's manifest are regenerated,
+        see `self.load_manifest()`.
+        If `samples` is False then only the plate images and their tile
+        pyramids are saved, e.g for titration plates, although images are
+        still loaded and resized in the same single pass.
         """
-        self.create_output_dir()
-        self.create_img_store()
-        self.stitch_and_save_plates()
-        self.stitch_and_save_samples()
+        utils.reset_peak_rss()
+        cache = get_cache()
+        cache_hits, cache_misses = (cache.hits, cache.misses) if cache else (0, 0)
+        plate_barcode = self.get_plate_barcode()
+        self.create_output_dir(writer=False)
+        if self.skip_unchanged:
+            self.load_manifest()
+        if not samples:
+            self.stale_outputs = {
+                f"plate_{channel}"
+                for channel in CHANNELS
+                if self.is_stale(f"plate_{channel}")
+            }
+        if self.stale_outputs is not None and not self.stale_outputs:
+            # no writer is made, so an existing container is left untouched
+            log.info(f"{plate_barcode}: all outputs up to date, skipping")
+            return
+        self.create_writer()
+        self.checkpoint = self.create_checkpoint()
+        try:
+            if self.streaming:
+                self.stream_samples_and_plates()
+            else:
+                self.create_img_store()
+                self.stitch_and_save_plates()
+                self.stitch_and_save_samples()
+        finally:
+            if self.checkpoint is not None:
+                self.checkpoint.flush()
+            try:
+                self.writer.close()
+            finally:
+                if self.manifest is not None:
+                    self.save_manifest()
+        self.peak_rss_mb = utils.get_peak_rss_mb()
+        log.info(f"{plate_barcode}: peak RSS {self.peak_rss_mb:.0f} MB")
+        if cache:
+            log.info(
+                f"{plate_barcode}: image cache {cache.hits - cache_hits} hits, "
+                f"{cache.misses - cache_misses} misses"
+            )
+
+    def create_checkpoint(self) -> Optional[Checkpoint]:
+        """
+        Create or resume the checkpoint for this plate, which is specific to
+        the indexfile and the stitching parameters. Returns None if
+        checkpoints are disabled, or the checkpoint directory can't be used.
+        """
+        if not self.checkpoint_dir or self.checkpoint_interval <= 0:
+            return None
+        version = hash_inputs(
+            [sha256_file(self.indexfile_path), self.get_stitch_params()]
+        )
+        try:
+            return Checkpoint(
+                self.get_plate_barcode(),
+                version,
+                self.checkpoint_dir,
+                self.checkpoint_interval,
+            )
+        except OSError as err:
+            log.error(f"disabling checkpoint in {self.checkpoint_dir}: {err}")
+            return None
+
+    def get_stitch_params(self) -> Dict:
+        """parameters which change the stitched outputs"""
+        return {
+            "max_intensity": {
+                str(channel): max_intensity
+                for channel, max_intensity in self.max_intensity_channel.items()
+            },
+            "img_size_sample": list(self.img_size_sample),
+            "img_size_plate_well": list(self.img_size_plate_well),
+            "missing_well_img_path": self.missing_well_img_path,
+            "compression_profile": self.compression_profile,
+            "output_mode": self.output_mode,
+            "tile_pyramid": self.tile_pyramid,
+            "pyramid_tile_size": self.pyramid_tile_size,
+        }
+
+    def get_output_inputs(self) -> Dict[str, str]:
+        """
+        hash of the indexfile rows used to make each output, where each
+        image is identified by its position, channel and URL
+        """
+        inputs = defaultdict(list)
+        for row in self.indexfile.rows():
+            well_96, _, _ = self.get_slots(row)
+            key = [*row.key, row.url]
+            inputs[f"well_{well_96}"].append(key)
+            inputs[f"plate_{row.channel}"].append(key)
+        return {name: hash_inputs(sorted(keys)) for name, keys in inputs.items()}
+
+    def load_manifest(self) -> None:
+        """
+        Load the plate's manifest from the output directory, and find which
+        outputs need to be regenerated because they are missing, or their
+        inputs or the stitching parameters have changed.
+        A container is always rewritten in full, so if anything in it is out
+        of date then every output is regenerated.
+        """
+        self.manifest = Manifest(
+            self.output_dir_path,
+            sha256_file(self.indexfile_path),
+            self.get_stitch_params(),
+        )
+        self.output_inputs = self.get_output_inputs()
+        self.stale_outputs = {
+            name
+            for name, inputs_sha256 in self.output_inputs.items()
+            if not self.manifest.is_current(name, inputs_sha256)
+        }
+        if self.output_mode == "container" and self.stale_outputs:
+            self.stale_outputs = set(self.output_inputs)
+        log.info(
+            f"{self.get_plate_barcode()}: {len(self.stale_outputs)} of "
+            f"{len(self.output_inputs)} outputs to regenerate"
+        )
+
+    def save_manifest(self) -> None:
+        """
+        Record every output saved by the writer in the manifest. Outputs
+        which used the placeholder for an image that couldn't be loaded are
+        removed from the manifest, so they are regenerated next time.
+        """
+        incomplete = set()
+        missing_keys = []
+        for row in self.missing_images:
+            well_96, _, _ = self.get_slots(row)
+            incomplete.update([f"well_{well_96}", f"plate_{row.channel}"])
+            missing_keys.append(list(row.key))
+        self.manifest.missing_images = sorted(missing_keys)
+        for name, inputs_sha256 in self.output_inputs.items():
+            if name in incomplete:
+                self.manifest.discard(name)
+            elif name in self.writer.written:
+                file, sha256 = self.writer.written[name]
+                self.manifest.record(name, inputs_sha256, file, sha256)
+        self.manifest.save()
+
+    def repair_missing_images(self, samples: bool = True) -> None:
+        """
+        Re-fetch only the images which couldn't be loaded when the plate was
+        last stitched, as recorded in the plate's manifest, and patch them
+        into the existing sample montages, plate montages and tile pyramids.
+        Everything else is reused from the saved outputs.
+        If the plate can't be repaired, because there is no manifest for the
+        current indexfile and parameters, outputs are missing or they are
+        saved in a container, then the plate is stitched again instead.
+        If `samples` is False then only the plate images are repaired, as
+        for plates stitched with
+        `self.stitch_and_save_all_samples_and_plates(samples=False)`.
+        """
+        plate_barcode = self.get_plate_barcode()
+        self.create_output_dir(writer=False)
+        self.load_manifest()
+        if not samples:
+            self.output_inputs = {
+                name: inputs_sha256
+                for name, inputs_sha256 in self.output_inputs.items()
+                if name.startswith("plate_")
+            }
+        if not self.can_repair(samples):
+            log.warning(f"{plate_barcode}: can't repair, stitching whole plate")
+            self.stitch_and_save_all_samples_and_plates(samples=samples)
+            return
+        self.create_writer()
+        rows = [self.indexfile.get(*key) for key in self.manifest.missing_images]
+        log.info(f"{plate_barcode}: repairing {len(rows)} missing images")
+        try:
+            self.patch_images(rows, samples=samples)
+        finally:
+            try:
+                self.writer.close()
+            finally:
+                self.save_manifest()
+
+    def can_repair(self, samples: bool = True) -> bool:
+        """
+        whether the saved outputs can be patched, see
+        `self.repair_missing_images()`, tile pyramids are rebuilt from the
+        sample montages so can't be repaired without them
+        """
+        extension = get_profile(self.compression_profile)["extension"]
+        return (
+            self.output_mode == "files"
+            and self.manifest.same_indexfile
+            and (samples or not self.tile_pyramid)
+            and all(
+                os.path.exists(
+                    os.path.join(self.output_dir_path, f"{name}.{extension}")
+                )
+                for name in self.output_inputs
+            )
+        )
+
+    def patch_images(self, rows: List[IndexfileRow], samples: bool = True) -> None:
+        """
+        Load images from indexfile rows and write their thumbnails into the
+        saved sample and plate montages, then save the patched montages and
+        rebuild the tile pyramids of the patched plates.
+        Images which still can't be loaded are left as the placeholder.
+        If `samples` is False then only the plate montages are patched.
+        """
+        imgs_by_channel = defaultdict(list)
+        for row, img in self.load_imgs(rows):
+            if img is not None:
+                imgs_by_channel[row.channel].append((row, img))
+        sample_montages = dict()
+        plate_montages = dict()
+        for channel, channel_imgs in imgs_by_channel.items():
+            channel_rows, imgs = zip(*channel_imgs)
+            imgs_sample, imgs_plate_well = self.make_thumbnails(
+                channel_rows, imgs, channel
+            )
+            plate_montages[channel] = self.writer.read(f"plate_{channel}")
+            for row, img_sample, img_plate_well in zip(
+                channel_rows, imgs_sample, imgs_plate_well
+            ):
+                well_96, sample_idx, plate_idx = self.get_slots(row)
+                self.plate_layout.put(
+                    plate_montages[channel], plate_idx, img_plate_well
+                )
+                if not samples:
+                    continue
+                if well_96 not in sample_montages:
+                    sample_montages[well_96] = self.writer.read(f"well_{well_96}")
+                self.sample_layout.put(sample_montages[well_96], sample_idx, img_sample)
+        for well_96, sample_montage in sample_montages.items():
+            self.save_image(f"well_{well_96}", sample_montage)
+        for channel, plate_montage in plate_montages.items():
+            self.save_image(f"plate_{channel}", plate_montage)
+        if samples and self.tile_pyramid and plate_montages:
+            pyramid_stores = self.read_pyramid_stores(
+                list(plate_montages), sample_montages
+            )
+            for channel, pyramid_arr in pyramid_stores.items():
+                self.save_pyramid(channel, pyramid_arr)
+
+    def read_pyramid_stores(
+        self, channels: List[int], sample_montages: Dict[str, np.ndarray]
+    ) -> Dict[int, np.ndarray]:
+        """
+        Rebuild the full-resolution plate montages for the tile pyramids of
+        `channels` from the sample montages, which hold the same sample-size
+        thumbnails. Montages are taken from `sample_montages` if present,
+        otherwise they are read from the output directory.
+        """
+        pyramid_stores = {
+            channel: self.pyramid_layout.new_canvas() for channel in channels
+        }
+        for well_96, sample_rows in self.get_rows_by_sample().items():
+            sample_montage = sample_montages.get(well_96)
+            if sample_montage is None:
+                sample_montage = self.writer.read(f"well_{well_96}")
+            for row in sample_rows:
+                if row.channel in pyramid_stores:
+                    _, sample_idx, plate_idx = self.get_slots(row)
+                    tile = self.sample_layout.slot(sample_montage, sample_idx)
+                    self.pyramid_layout.put(
+                        pyramid_stores[row.channel], plate_idx, tile
+                    )
+        return pyramid_stores
+
+    def is_stale(self, name: str) -> bool:
+        """whether an output needs to be regenerated"""
+        return self.stale_outputs is None or name in self.stale_outputs
+
+    def save_image(self, filename: str, arr: np.ndarray) -> None:
+        """
+        queue an 8-bit image to be saved to the plate's output directory by
+        the writer pool, `filename` is given without an extension as that
+        depends on the compression profile
+        """
+        self.writer.write(filename, arr)
+
+    def save_pyramid(self, channel_num: int, plate_arr: np.ndarray) -> None:
+        """
+        save a DeepZoom tile pyramid of a full-resolution plate montage, as
+        `plate_<channel>.dzi` and tiles in `plate_<channel>_files/`
+        """
+        name = f"plate_{channel_num}"
+        fmt = self.writer.profile["extension"]
+        descriptor = dzi_descriptor(plate_arr.shape, self.pyramid_tile_size, fmt)
+        self.writer.write_bytes(f"{name}.dzi", descriptor.encode("utf-8"))
+        for level, level_arr in iter_levels(plate_arr):
+            for col, row, tile in iter_tiles(level_arr, self.pyramid_tile_size):
+                self.save_image(f"{name}_files/{level}/{col}_{row}", tile)
 
     def save_plates(self):
         """save stitched plates"""
-        self.create_output_dir()
         if self.plate_images is None:
             raise RuntimeError("no plate images, have you run stitch_plate()?")
-        for channel_num, plate_arr in self.plate_images.items():
-            plate_path = os.path.join(self.output_dir_path, f"plate_{channel_num}.png")
-            plate_arr = np.clip(plate_arr, -1, 1)
-            plate_arr = skimage.img_as_ubyte(plate_arr)
-            skimage.io.imsave(fname=plate_path, arr=plate_arr)
+        self.create_output_dir()
+        try:
+            for channel_num, plate_arr in self.plate_images.items():
+                self.save_image(f"plate_{channel_num}", plate_arr)
+        finally:
+            self.writer.close()
 
     def save_all(self):
         """save both stitched plate and sample images"""
-        self.create_output_dir()
         if self.dilution_images is None:
             raise RuntimeError("no dilution images, have you run stitch_all_samples()?")
         if self.plate_images is None:
             raise RuntimeError("no plate images, have you run stitch_plate()?")
-        for channel_num, plate_arr in self.plate_images.items():
-            plate_path = os.path.join(self.output_dir_path, f"plate_{channel_num}.png")
-            plate_arr = skimage.img_as_ubyte(np.clip(plate_arr, -1, 1))
-            skimage.io.imsave(fname=plate_path, arr=plate_arr)
-        for well_name, well_arr in self.dilution_images.items():
-            well_path = os.path.join(self.output_dir_path, f"well_{well_name}.png")
-            well_arr = skimage.img_as_ubyte(np.clip(well_arr, -1, 1))
-            skimage.io.imsave(fname=well_path, arr=well_arr)
-
-    def create_output_dir(self):
-        """create output directory if it doesn't already exist"""
+        self.create_output_dir()
+        try:
+            for channel_num, plate_arr in self.plate_images.items():
+                self.save_image(f"plate_{channel_num}", plate_arr)
+            for well_name, well_arr in self.dilution_images.items():
+                self.save_image(f"well_{well_name}", well_arr)
+        finally:
+            self.writer.close()
+
+    def create_output_dir(self, writer: bool = True):
+        """
+        create output directory if it doesn't already exist, and a writer
+        pool to save images to it unless `writer` is False, see
+        `self.create_writer()`
+        """
         plate_barcode = self.get_plate_barcode()
         if not plate_barcode.startswith(("T", "S")):
             # standardise the sample type on "S" for non-titration plates
@@ -343,6 +947,21 @@ class ImageStitcher:
         output_dir_path = os.path.join(self.output_dir, plate_barcode)
         os.makedirs(output_dir_path, exist_ok=True)
         self.output_dir_path = output_dir_path
+        if writer:
+            self.create_writer()
+
+    def create_writer(self):
+        """
+        create a writer pool to save images to the output directory, either
+        as separate files or into a single container depending on
+        `self.output_mode`
+        """
+        self.writer = create_writer(
+            self.output_dir_path,
+            self.output_mode,
+            self.n_writers,
+            self.compression_profile,
+        )
 
     def get_plate_barcode(self) -> str:
         """get plate barcode from indexfile path"""
@@ -351,7 +970,8 @@ class ImageStitcher:
 
     def collect_missing_images(self) -> List[str]:
         missing = set()
-        for i in self.missing_images:
-            name = f"r{i['Row']}c{i['Column']} {i['Channel Name']}"
+        for row in self.missing_images:
+            channel_name = self.indexfile.channel_name(row.channel)
+            name = f"r{row.row_num}c{row.col_num} {channel_name}"
             missing.add(name)
         return sorted(list(missing))
@@ -1,15 +1,16 @@
 import os
-import time
 from enum import Enum, auto
 from typing import List, Tuple
 from urllib.error import HTTPError, URLError
 
 import celery
+import checkpoint
 import db
 import plaque_assay
 import slack
 import sqlalchemy.exc
 import stitch_images
+import utils
 from config import parse_config
 
 cfg_celery = parse_config()["celery"]
@@ -45,6 +46,7 @@ class BaseTask(celery.Task):
         if task_type == Task.STITCHING:
             plate_name = self.get_plate_name_stitch(args)
             database.mark_stitching_entry_as_finished(plate_name)
+            checkpoint.delete_checkpoint(plate_name)
         if task_type == Task.TITRATION:
             workflow_id = self.get_workflow(args)
             variant = self.get_variant(args, database, titration=True)
@@ -145,14 +147,12 @@ class BaseTask(celery.Task):
     base=BaseTask,
     autoretry_for=(
         ConnectionResetError,
-        FileNotFoundError,
         BlockingIOError,
         sqlalchemy.exc.OperationalError,
     ),
 )
 def background_analysis_384(plate_list: List[str]):
     """check for new experiment directory"""
-    time.sleep(10)
     plaque_assay.main.run(plate_list)
 
 
@@ -161,7 +161,6 @@ def background_analysis_384(plate_list: List[str]):
     base=BaseTask,
     autoretry_for=(
         ConnectionResetError,
-        FileNotFoundError,
         URLError,
         HTTPError,
         BlockingIOError,
@@ -170,7 +169,6 @@ def background_analysis_384(plate_list: List[str]):
 )
 def background_image_stitch_384(indexfile_path: str):
     """image stitching for 384 well plate"""
-    time.sleep(10)
     stitcher = stitch_images.ImageStitcher(indexfile_path)
     stitcher.stitch_and_save_all_samples_and_plates()
     missing = stitcher.collect_missing_images()
@@ -178,12 +176,34 @@ def background_image_stitch_384(indexfile_path: str):
         slack.send_warning(f"Missing images: {indexfile_path} {missing}")
 
 
+@celery.task(
+    queue="image_stitch",
+    base=BaseTask,
+    autoretry_for=(
+        ConnectionResetError,
+        URLError,
+        HTTPError,
+        BlockingIOError,
+        sqlalchemy.exc.OperationalError,
+    ),
+)
+def background_image_stitch_repair_384(indexfile_path: str):
+    """re-fetch and patch in missing images for a stitched 384 well plate"""
+    stitcher = stitch_images.ImageStitcher(indexfile_path)
+    is_titration = utils.is_titration_plate(stitcher.get_plate_barcode())
+    stitcher.repair_missing_images(
+        samples=stitch_images.TITRATION_SAMPLES or not is_titration
+    )
+    missing = stitcher.collect_missing_images()
+    if missing:
+        slack.send_warning(f"Missing images after repair: {indexfile_path} {missing}")
+
+
 @celery.task(
     queue="image_stitch_titration",
     base=BaseTask,
     autoretry_for=(
         ConnectionResetError,
-        FileNotFoundError,
         URLError,
         HTTPError,
         BlockingIOError,
@@ -192,10 +212,10 @@ def background_image_stitch_384(indexfile_path: str):
 )
 def background_image_stitch_titration_384(indexfile_path: str):
     """image stitching for 384 well plate"""
-    time.sleep(10)
     stitcher = stitch_images.ImageStitcher(indexfile_path)
-    stitcher.stitch_plate()
-    stitcher.save_plates()
+    stitcher.stitch_and_save_all_samples_and_plates(
+        samples=stitch_images.TITRATION_SAMPLES
+    )
     missing = stitcher.collect_missing_images()
     if missing:
         slack.send_warning(f"Missing images: {indexfile_path} {missing}")
@@ -206,12 +226,10 @@ def background_image_stitch_titration_384(indexfile_path: str):
     base=BaseTask,
     autoretry_for=(
         ConnectionResetError,
-        FileNotFoundError,
         BlockingIOError,
         sqlalchemy.exc.OperationalError,
     ),
 )
 def background_titration_analysis_384(plate_list: List[str]):
     """titration analysis"""
-    time.sleep(10)
     plaque_assay.titration.main.run(plate_list)
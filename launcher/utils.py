@@ -1,7 +1,9 @@
+import itertools
 import logging
 import os
+import resource
 from string import ascii_uppercase
-from typing import Optional, Tuple
+from typing import Iterable, Iterator, List, Optional, Tuple
 
 import slack
 from well_dict import well_dict_r
@@ -120,3 +122,36 @@ def dilution_from_well(well: str) -> int:
     if row % 2 == 1 and col % 2 == 1:
         return 1
     raise ValueError("shouldn't reach here")
+
+
+def batched(iterable: Iterable, n: int) -> Iterator[List]:
+    """batch items from an iterable into lists of length n, the last may be shorter"""
+    iterator = iter(iterable)
+    while batch := list(itertools.islice(iterator, n)):
+        yield batch
+
+
+def reset_peak_rss() -> None:
+    """
+    Reset the peak resident set size of the current process, so the next
+    `get_peak_rss_mb()` reports the peak since this call.
+    This is only supported on Linux, elsewhere the peak is since process start.
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def get_peak_rss_mb() -> float:
+    """get peak resident set size of the current process in MB"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # ru_maxrss is in kB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
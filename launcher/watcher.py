@@ -0,0 +1,197 @@
+"""
+Wait for changes to a results directory, for the long-running dispatcher in
+`run_daemon.py`.
+
+Directories are watched with inotify where possible, so new exports are
+noticed within seconds. inotify only sees changes made through the local
+kernel though, so on network filesystems such as NFS, exports written by
+other machines are never seen. These directories are polled instead,
+quickly after a change and backing off while nothing changes. Polling is
+cheap, as a results directory which hasn't been modified isn't listed, see
+`Snapshot.is_unmodified()`.
+"""
+
+import ctypes
+import logging
+import os
+import select
+import struct
+import threading
+import time
+from typing import Optional, Tuple
+
+from config import parse_config
+
+cfg_watch = parse_config()["watch"]
+
+POLL_MIN_INTERVAL = cfg_watch.getfloat("poll_min_interval")
+POLL_MAX_INTERVAL = cfg_watch.getfloat("poll_max_interval")
+SETTLE_TIME = cfg_watch.getfloat("settle_time")
+NETWORK_FS_TYPES = tuple(i.strip() for i in cfg_watch["network_fs_types"].split(","))
+
+# inotify constants from <sys/inotify.h>
+IN_ATTRIB = 0x00000004
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_IGNORED = 0x00008000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+# changes to the names in a directory, or to the directory itself
+WATCH_MASK = (
+    IN_ATTRIB
+    | IN_MOVED_FROM
+    | IN_MOVED_TO
+    | IN_CREATE
+    | IN_DELETE
+    | IN_DELETE_SELF
+    | IN_MOVE_SELF
+)
+EVENT_HEADER = struct.Struct("iIII")
+
+log = logging.getLogger(__name__)
+
+
+def get_fs_type(path: str, mounts_path: str = "/proc/mounts") -> Optional[str]:
+    """
+    filesystem type of the mount containing `path`, or None if it can't be
+    found
+    """
+    path = os.path.realpath(path)
+    best_mount, best_type = "", None
+    try:
+        with open(mounts_path) as f:
+            lines = f.readlines()
+    except OSError:
+        return None
+    for line in lines:
+        fields = line.split()
+        if len(fields) < 3:
+            continue
+        # spaces and other characters in mount points are octal escaped
+        mount = fields[1].encode().decode("unicode_escape")
+        is_parent = path == mount or path.startswith(mount.rstrip("/") + "/")
+        if is_parent and len(mount) >= len(best_mount):
+            best_mount, best_type = mount, fields[2]
+    return best_type
+
+
+class Inotify:
+    """
+    An inotify watch on a single directory, using libc through ctypes.
+    Raises OSError if inotify isn't available.
+    """
+
+    def __init__(self, path: str, mask: int = WATCH_MASK):
+        libc = ctypes.CDLL(None, use_errno=True)
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, f"inotify_init1: {os.strerror(errno)}")
+        wd = libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(errno, f"inotify_add_watch: {os.strerror(errno)}", path)
+
+    def wait(self, timeout: float) -> int:
+        """
+        wait up to `timeout` seconds for events, returning the combined mask
+        of every event read, or 0 if there were none
+        """
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        return self.read_events() if readable else 0
+
+    def read_events(self) -> int:
+        """read every pending event, returning their combined mask"""
+        mask = 0
+        while True:
+            try:
+                buffer = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                return mask
+            offset = 0
+            while offset < len(buffer):
+                _, event_mask, _, name_len = EVENT_HEADER.unpack_from(buffer, offset)
+                mask |= event_mask
+                offset += EVENT_HEADER.size + name_len
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+class DirectoryWatcher:
+    """
+    Waits until a directory may have changed, using inotify unless the
+    directory is on a network filesystem or inotify isn't available, in which
+    case it is polled.
+    Polling starts every `poll_min_interval` seconds after a change and
+    doubles while nothing changes, up to `poll_max_interval` seconds. With
+    inotify the directory is still checked every `poll_max_interval`
+    seconds in case an event is missed, and after an event it waits
+    `settle_time` seconds for the rest of an export to arrive.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        poll_min_interval: float = POLL_MIN_INTERVAL,
+        poll_max_interval: float = POLL_MAX_INTERVAL,
+        settle_time: float = SETTLE_TIME,
+        network_fs_types: Tuple[str] = NETWORK_FS_TYPES,
+    ):
+        self.path = path
+        self.poll_min_interval = poll_min_interval
+        self.poll_max_interval = poll_max_interval
+        self.settle_time = settle_time
+        self.interval = poll_min_interval
+        self.inotify = None
+        fs_type = get_fs_type(path)
+        if fs_type in network_fs_types:
+            log.info(f"{path} is on {fs_type}, polling for changes")
+        else:
+            self.start_inotify()
+
+    def start_inotify(self) -> None:
+        try:
+            self.inotify = Inotify(self.path)
+            log.info(f"watching {self.path} with inotify")
+        except OSError as err:
+            log.warning(f"can't watch {self.path} with inotify, polling: {err}")
+            self.inotify = None
+
+    def wait(self, changed: bool, stop: threading.Event) -> None:
+        """
+        block until the directory may have changed, or `stop` is set, where
+        `changed` is whether the last check found any changes
+        """
+        if self.inotify is None:
+            if changed:
+                self.interval = self.poll_min_interval
+            stop.wait(self.interval)
+            self.interval = min(self.interval * 2, self.poll_max_interval)
+            return
+        deadline = time.monotonic() + self.poll_max_interval
+        while not stop.is_set():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            # wake up regularly to check whether to stop
+            mask = self.inotify.wait(min(remaining, 1.0))
+            if mask & IN_IGNORED:
+                # the directory was removed or moved, so watch it again
+                self.inotify.close()
+                self.start_inotify()
+                return
+            if mask:
+                stop.wait(self.settle_time)
+                self.inotify.read_events()
+                return
+
+    def close(self) -> None:
+        if self.inotify is not None:
+            self.inotify.close()
+            self.inotify = None
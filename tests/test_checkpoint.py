@@ -0,0 +1,45 @@
+import os
+import sys
+
+import numpy as np
+
+BASE_DIR = os.path.dirname(__file__)
+sys.path.append(os.path.join(BASE_DIR, "..", "launcher"))
+from checkpoint import Checkpoint, delete_checkpoint
+
+
+def make_thumbnails(i):
+    return (
+        np.full((36, 36), i, dtype=np.uint8),
+        np.full((8, 8), i, dtype=np.uint8),
+    )
+
+
+def test_checkpoint_resumes_saved_chunks(tmp_path):
+    checkpoint = Checkpoint("S01000999", "v1", str(tmp_path), interval=2)
+    for i in range(5):
+        checkpoint.add((1, i + 1, 1), *make_thumbnails(i))
+    # only complete chunks are saved until flushed
+    resumed = Checkpoint("S01000999", "v1", str(tmp_path), interval=2)
+    assert len(resumed.thumbnails) == 4
+    checkpoint.flush()
+    resumed = Checkpoint("S01000999", "v1", str(tmp_path), interval=2)
+    assert len(resumed.thumbnails) == 5
+    img_sample, img_plate_well = resumed.get((1, 5, 1))
+    assert (img_sample == 4).all() and (img_plate_well == 4).all()
+    assert resumed.get((2, 1, 1)) is None
+
+
+def test_checkpoint_cleared_for_new_version(tmp_path):
+    checkpoint = Checkpoint("S01000999", "v1", str(tmp_path), interval=1)
+    checkpoint.add((1, 1, 1), *make_thumbnails(0))
+    assert Checkpoint("S01000999", "v2", str(tmp_path)).thumbnails == {}
+    assert Checkpoint("S01000999", "v1", str(tmp_path)).thumbnails == {}
+
+
+def test_delete_checkpoint(tmp_path):
+    checkpoint = Checkpoint("S01000999", "v1", str(tmp_path), interval=1)
+    checkpoint.add((1, 1, 1), *make_thumbnails(0))
+    delete_checkpoint("S01000999", str(tmp_path))
+    assert not os.path.exists(os.path.join(tmp_path, "S01000999"))
+    delete_checkpoint("S01000999", str(tmp_path))
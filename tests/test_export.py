@@ -0,0 +1,81 @@
+import os
+import sys
+
+BASE_DIR = os.path.dirname(__file__)
+sys.path.append(os.path.join(BASE_DIR, "..", "launcher"))
+import export
+from export import ExportState
+
+HEADER = "Row\tColumn\tField\tChannel ID\tURL\n"
+
+
+def write_indexfile(plate_dir, n_rows, mtime):
+    indexfile_path = plate_dir / "indexfile.txt"
+    rows = [f"1\t1\t1\t1\timage_{i}.tiff\n" for i in range(n_rows)]
+    indexfile_path.write_text(HEADER + "".join(rows))
+    os.utime(indexfile_path, (mtime, mtime))
+
+
+def get_state(plate_dir, first_seen, now):
+    return export.get_export_state(
+        str(plate_dir),
+        first_seen,
+        now,
+        indexfile_name="indexfile.txt",
+        expected_rows=4,
+        settle_time=30,
+        incomplete_timeout=600,
+        abandon_timeout=3600,
+    )
+
+
+def test_count_indexfile_rows(tmp_path):
+    write_indexfile(tmp_path, 3, 1000)
+    assert export.count_indexfile_rows(str(tmp_path / "indexfile.txt")) == 3
+    write_indexfile(tmp_path, 0, 1000)
+    assert export.count_indexfile_rows(str(tmp_path / "indexfile.txt")) == 0
+
+
+def test_export_state(tmp_path):
+    first_seen = 1000
+    # no indexfile yet
+    assert get_state(tmp_path, first_seen, 1010) == ExportState.PENDING
+    assert get_state(tmp_path, first_seen, 4600) == ExportState.ABANDONED
+    # complete, but still recently modified
+    write_indexfile(tmp_path, 4, 1100)
+    assert get_state(tmp_path, first_seen, 1110) == ExportState.PENDING
+    assert get_state(tmp_path, first_seen, 1130) == ExportState.COMPLETE
+    # missing rows, accepted once it has stopped changing for long enough
+    write_indexfile(tmp_path, 2, 1100)
+    assert get_state(tmp_path, first_seen, 1130) == ExportState.PENDING
+    assert get_state(tmp_path, first_seen, 1700) == ExportState.INCOMPLETE
+    # only a header is never accepted
+    write_indexfile(tmp_path, 0, 1100)
+    assert get_state(tmp_path, first_seen, 1700) == ExportState.PENDING
+    assert get_state(tmp_path, first_seen, 4600) == ExportState.ABANDONED
+
+
+def test_parse_required_files():
+    assert export.parse_required_files("") == []
+    assert export.parse_required_files(" a/*.txt, b.txt,") == ["a/*.txt", "b.txt"]
+
+
+def test_analysis_waits_for_required_files(tmp_path):
+    required_files = ["Evaluation*/PlateResults.txt"]
+    write_indexfile(tmp_path, 4, 1100)
+    # the export itself only waits for the indexfile
+    assert get_state(tmp_path, 1000, 1130) == ExportState.COMPLETE
+    assert export.is_analysis_ready(str(tmp_path), [], 1130)
+    assert not export.is_analysis_ready(str(tmp_path), required_files, 1130)
+    results_path = tmp_path / "Evaluation1" / "PlateResults.txt"
+    results_path.parent.mkdir()
+    results_path.write_text("results")
+    os.utime(results_path, (1120, 1120))
+    assert not export.is_analysis_ready(str(tmp_path), required_files, 1130)
+    assert export.is_analysis_ready(str(tmp_path), required_files, 1150)
+
+
+def test_export_state_unreadable_indexfile_is_pending(tmp_path):
+    # reading a directory raises an OSError other than FileNotFoundError
+    (tmp_path / "indexfile.txt").mkdir()
+    assert get_state(tmp_path, 1000, 1130) == ExportState.PENDING
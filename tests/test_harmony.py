@@ -0,0 +1,51 @@
+import os
+import sys
+import time
+
+BASE_DIR = os.path.dirname(__file__)
+sys.path.append(os.path.join(BASE_DIR, "..", "launcher"))
+import harmony
+from harmony import ImageCache
+
+
+def test_image_cache_hits_and_misses(tmp_path):
+    cache = ImageCache(str(tmp_path), max_bytes=1000)
+    url = "http://10.6.58.91/ODA/Images/C/1.tiff"
+    assert cache.get(url) is None
+    cache.put(url, b"image")
+    assert cache.get(url) == b"image"
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_image_cache_evicts_least_recently_used(tmp_path):
+    cache = ImageCache(str(tmp_path), max_bytes=250)
+    urls = [f"http://10.6.58.91/ODA/Images/C/{i}.tiff" for i in range(3)]
+    for url in urls[:2]:
+        cache.put(url, b"x" * 100)
+    # make sure the first image is the most recently used
+    past = time.time() - 60
+    os.utime(cache.path(urls[1]), (past, past))
+    assert cache.get(urls[0]) is not None
+    cache.put(urls[2], b"x" * 100)
+    assert cache.get(urls[1]) is None
+    assert cache.get(urls[0]) is not None
+    assert cache.get(urls[2]) is not None
+    assert cache.size_bytes <= 250
+
+
+def test_image_cache_counts_other_processes(tmp_path):
+    # two caches sharing a directory, like two worker processes on a node
+    caches = [ImageCache(str(tmp_path), max_bytes=250, rescan_puts=1) for _ in "ab"]
+    urls = [f"http://10.6.58.91/ODA/Images/C/{i}.tiff" for i in range(3)]
+    for cache, url in zip([caches[0], caches[1], caches[0]], urls):
+        cache.put(url, b"x" * 100)
+    assert caches[0].get_total_bytes() <= 250
+    assert caches[0].get(urls[2]) is not None
+
+
+def test_session_pool_grows_with_concurrency():
+    small = harmony.get_session(pool_maxsize=2)
+    assert harmony.get_session(pool_maxsize=1) is small
+    large = harmony.get_session(pool_maxsize=16)
+    assert large is not small
+    assert large.get_adapter("http://10.6.58.91")._pool_maxsize == 16
@@ -0,0 +1,151 @@
+import os
+import sys
+
+import numpy as np
+import skimage
+import skimage.io
+import skimage.util
+
+BASE_DIR = os.path.dirname(__file__)
+TEST_DATA_DIR = os.path.join(BASE_DIR, "test_data")
+MISSING_IMG_PATH = os.path.join(TEST_DATA_DIR, "placeholder_image.png")
+
+sys.path.append(os.path.join(BASE_DIR, "..", "launcher"))
+import image_ops
+
+IMG_SIZE_SAMPLE = (360, 360)
+IMG_SIZE_PLATE_WELL = (80, 80)
+MAX_INTENSITY = 800
+
+
+def make_test_images():
+    """placeholder image and a synthetic noisy 1080x1080 image with a bright blob"""
+    rng = np.random.default_rng(42)
+    yy, xx = np.mgrid[:1080, :1080]
+    blob = 1500 * np.exp(-((yy - 500) ** 2 + (xx - 400) ** 2) / (2 * 150.0**2))
+    noisy = (rng.integers(0, 600, size=(1080, 1080)) + blob).astype(np.uint16)
+    placeholder = skimage.io.imread(MISSING_IMG_PATH, as_gray=True)
+    return [noisy, placeholder]
+
+
+def rescale(img):
+    img = img.astype(np.float64) / MAX_INTENSITY
+    img[img > 1.0] = 1.0
+    return img
+
+
+def to_ubyte(img):
+    return skimage.img_as_ubyte(np.clip(img, -1, 1)).astype(int)
+
+
+def test_make_thumbnails_within_tolerance_of_direct_resize():
+    """
+    Thumbnails should be close to rescaling the full-size image and then
+    resizing it directly to each size, as the stitcher originally did, even
+    though plate-well thumbnails are downsampled from the sample thumbnails.
+    """
+    noisy, placeholder = make_test_images()
+    # (image, size, max mean pixel difference, max pixel difference)
+    tolerances = [
+        (noisy, IMG_SIZE_SAMPLE, 6.0, 32),
+        (noisy, IMG_SIZE_PLATE_WELL, 1.0, 4),
+        (placeholder, IMG_SIZE_SAMPLE, 0.05, 1),
+        (placeholder, IMG_SIZE_PLATE_WELL, 1.0, 12),
+    ]
+    for img, size, max_mean_diff, max_diff in tolerances:
+        imgs_sample, imgs_plate_well = image_ops.make_thumbnails(
+            [img], MAX_INTENSITY, IMG_SIZE_SAMPLE, IMG_SIZE_PLATE_WELL
+        )
+        thumbnail = imgs_sample[0] if size == IMG_SIZE_SAMPLE else imgs_plate_well[0]
+        direct = to_ubyte(image_ops.resize(rescale(img), size))
+        diff = np.abs(thumbnail.astype(int) - direct)
+        assert diff.mean() < max_mean_diff
+        assert diff.max() <= max_diff
+
+
+def test_downsample_stack_block_mean():
+    stack = np.arange(2 * 6 * 6, dtype=np.uint16).reshape(2, 6, 6)
+    out = image_ops.downsample_stack(stack, (2, 2))
+    assert out.shape == (2, 2, 2)
+    assert out[0, 0, 0] == stack[0, :3, :3].mean()
+    assert out[1, 1, 1] == stack[1, 3:, 3:].mean()
+
+
+def test_downsample_stack_falls_back_to_resize():
+    stack = np.random.default_rng(0).random((3, 360, 360))
+    out = image_ops.downsample_stack(stack, IMG_SIZE_PLATE_WELL)
+    for img, img_out in zip(stack, out):
+        np.testing.assert_array_equal(
+            img_out, image_ops.resize(img, IMG_SIZE_PLATE_WELL)
+        )
+
+
+def test_downsample_images_mixed_shapes_keeps_order():
+    noisy, placeholder = make_test_images()
+    imgs = [noisy, placeholder, noisy]
+    out = image_ops.downsample_images(imgs, IMG_SIZE_SAMPLE, clip_max=MAX_INTENSITY)
+    assert out.shape == (3, *IMG_SIZE_SAMPLE)
+    np.testing.assert_array_equal(out[0], out[2])
+    assert out.max() <= MAX_INTENSITY
+    # inputs are not modified by clipping
+    assert noisy.max() > MAX_INTENSITY
+
+
+def test_block_mean_within_tolerance_of_resize():
+    """
+    Block-mean downsampling filters pixel noise slightly differently to a
+    gaussian anti-aliased resize, but overall intensity and image structure
+    should be preserved.
+    """
+    noisy, _ = make_test_images()
+    yy, xx = np.mgrid[:1080, :1080]
+    smooth = 1200 * np.exp(-((yy - 500) ** 2 + (xx - 400) ** 2) / (2 * 150.0**2))
+    # (image, max mean pixel difference, max pixel difference), pixel noise
+    # is filtered differently so only a smooth image matches closely
+    for img, max_mean_diff, max_diff in [(noisy, 6.0, 32), (smooth, 0.01, 1)]:
+        img = rescale(img)
+        block = to_ubyte(image_ops.downsample_images([img], IMG_SIZE_SAMPLE)[0])
+        direct = to_ubyte(image_ops.resize(img, IMG_SIZE_SAMPLE))
+        assert abs(block.mean() - direct.mean()) < 0.5
+        diff = np.abs(block - direct)
+        assert diff.mean() < max_mean_diff
+        assert diff.max() <= max_diff
+
+
+def test_lut_matches_float_rescale():
+    lut = image_ops.build_lut(MAX_INTENSITY)
+    assert lut.shape == (2**16,)
+    assert lut.dtype == np.uint8
+    raw = np.arange(2**16, dtype=np.uint16)
+    np.testing.assert_array_equal(image_ops.apply_lut(raw, lut), to_ubyte(rescale(raw)))
+
+
+def test_apply_lut_rounds_resized_values():
+    lut = image_ops.build_lut(MAX_INTENSITY)
+    resized = np.array([0.4, 399.6, 1e6])
+    expected = lut[np.array([0, 400, 2**16 - 1])]
+    np.testing.assert_array_equal(image_ops.apply_lut(resized, lut), expected)
+
+
+def test_montage_layout_matches_skimage_montage():
+    tiles = np.random.default_rng(0).integers(0, 255, size=(8, 5, 7), dtype=np.uint8)
+    layout = image_ops.MontageLayout((2, 4), (5, 7), padding_width=3)
+    canvas = layout.new_canvas()
+    for idx, tile in enumerate(tiles):
+        layout.put(canvas, idx, tile)
+    expected = skimage.util.montage(
+        tiles, fill=255, padding_width=3, grid_shape=(2, 4), rescale_intensity=False
+    )
+    assert canvas.shape == layout.shape
+    np.testing.assert_array_equal(canvas, expected)
+
+
+def test_resize_thumbnail_matches_float_resize_and_rescale():
+    noisy, _ = make_test_images()
+    lut = image_ops.build_lut(MAX_INTENSITY)
+    for size in [IMG_SIZE_SAMPLE, IMG_SIZE_PLATE_WELL]:
+        thumbnail = image_ops.resize_thumbnail(noisy, size, lut)
+        expected = to_ubyte(rescale(image_ops.resize(noisy, size)))
+        assert thumbnail.shape == size
+        assert thumbnail.dtype == np.uint8
+        assert np.abs(thumbnail.astype(int) - expected).max() <= 1
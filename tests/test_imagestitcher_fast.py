@@ -44,11 +44,12 @@ def test_creates_parent_directory():
 def test_creates_all_expected_files():
     plate_output_dir = os.path.join(TEST_OUTPUT_DIR, "test_data")
     all_files = os.listdir(plate_output_dir)
-    assert len(all_files) == 98
+    assert len(all_files) == 99
     well_files = [i for i in all_files if i.startswith("well_")]
     assert len(well_files) == 96
     plate_files = [i for i in all_files if i.startswith("plate_")]
     assert len(plate_files) == 2
+    assert "manifest.json" in all_files
 
 
 def teardown_module():
@@ -0,0 +1,210 @@
+"""
+Stitch a small synthetic plate whose indexfile points at local image files,
+so unlike the other image stitching tests these don't need Harmony.
+"""
+
+import json
+import os
+import sys
+
+import numpy as np
+import pytest
+import skimage.io
+
+BASE_DIR = os.path.dirname(__file__)
+TEST_DATA_DIR = os.path.join(BASE_DIR, "test_data")
+MISSING_IMG_PATH = os.path.join(TEST_DATA_DIR, "placeholder_image.png")
+
+sys.path.append(os.path.join(BASE_DIR, "..", "launcher"))
+from output import CONTAINER_NAME, ContainerReader
+from stitch_images import ImageStitcher
+
+PLATE_DIR = "S01000001__2021-01-01T00_00_00-Measurement 1"
+HEADER = ["Row", "Column", "Field", "Channel ID", "Channel Name", "URL"]
+CHANNEL_NAMES = {1: "DAPI", 2: "Alexa 488"}
+IMG_SIZE = (60, 60)
+
+
+def make_plate(tmp_path, plate_dir_name=PLATE_DIR):
+    """write an image for every well and channel, and an indexfile of them"""
+    plate_dir = tmp_path / plate_dir_name
+    img_dir = plate_dir / "images"
+    img_dir.mkdir(parents=True)
+    rng = np.random.default_rng(42)
+    lines = ["\t".join(HEADER)]
+    for row_num in range(1, 17):
+        for col_num in range(1, 25):
+            for channel, channel_name in CHANNEL_NAMES.items():
+                img = rng.integers(0, 1500, size=IMG_SIZE).astype(np.uint16)
+                img_path = img_dir / f"r{row_num}c{col_num}ch{channel}.tiff"
+                skimage.io.imsave(str(img_path), img, check_contrast=False)
+                fields = [row_num, col_num, 1, channel, channel_name, img_path]
+                lines.append("\t".join(str(i) for i in fields))
+    indexfile_path = plate_dir / "indexfile.txt"
+    indexfile_path.write_text("\n".join(lines) + "\n")
+    return str(indexfile_path)
+
+
+def make_stitcher(indexfile_path, output_dir, **kwargs):
+    params = dict(
+        output_dir=str(output_dir),
+        missing_well_img_path=MISSING_IMG_PATH,
+        img_size_sample=(20, 20),
+        img_size_plate_well=(5, 5),
+        tile_pyramid=False,
+        skip_unchanged=False,
+        checkpoint_dir="",
+    )
+    params.update(kwargs)
+    return ImageStitcher(indexfile_path, **params)
+
+
+def read_outputs(output_dir):
+    """bytes of every output file, by path relative to `output_dir`"""
+    outputs = dict()
+    for dirpath, _, filenames in os.walk(output_dir):
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            with open(path, "rb") as f:
+                outputs[os.path.relpath(path, output_dir)] = f.read()
+    return outputs
+
+
+def test_concurrent_loading_matches_sequential(tmp_path):
+    indexfile_path = make_plate(tmp_path)
+    sequential = make_stitcher(
+        indexfile_path, tmp_path / "sequential", max_connections_per_host=1
+    )
+    concurrent = make_stitcher(
+        indexfile_path, tmp_path / "concurrent", max_connections_per_host=4
+    )
+    rows = list(sequential.indexfile.rows())
+    loaded_sequential = list(sequential.load_imgs(rows))
+    loaded_concurrent = list(concurrent.load_imgs(rows))
+    assert [row for row, _ in loaded_concurrent] == rows
+    for (_, img_sequential), (_, img_concurrent) in zip(
+        loaded_sequential, loaded_concurrent
+    ):
+        np.testing.assert_array_equal(img_sequential, img_concurrent)
+    for stitcher in (sequential, concurrent):
+        stitcher.stitch_and_save_all_samples_and_plates()
+    outputs = read_outputs(tmp_path / "sequential")
+    assert len(outputs) == 98
+    assert read_outputs(tmp_path / "concurrent") == outputs
+
+
+def stitch_with_missing_image(tmp_path, plate_dir_name, samples, **kwargs):
+    """
+    stitch a plate while one of its images can't be read, then make the
+    image available again, returning the stitcher parameters and the
+    barcode of the plate
+    """
+    indexfile_path = make_plate(tmp_path, plate_dir_name)
+    img_path = tmp_path / plate_dir_name / "images" / "r3c5ch2.tiff"
+    hidden_path = img_path.with_suffix(".hidden")
+    params = dict(skip_unchanged=True, **kwargs)
+    img_path.rename(hidden_path)
+    stitcher = make_stitcher(indexfile_path, tmp_path / "repaired", **params)
+    stitcher.stitch_and_save_all_samples_and_plates(samples=samples)
+    assert stitcher.collect_missing_images() == ["r3c5 Alexa 488"]
+    hidden_path.rename(img_path)
+    return indexfile_path, params, stitcher.get_plate_barcode()
+
+
+def test_repair_matches_full_restitch(tmp_path):
+    indexfile_path, params, barcode = stitch_with_missing_image(
+        tmp_path, PLATE_DIR, samples=True, tile_pyramid=True, pyramid_tile_size=64
+    )
+    stitcher = make_stitcher(indexfile_path, tmp_path / "repaired", **params)
+    stitcher.repair_missing_images()
+    assert stitcher.missing_images == []
+    # only the patched outputs and the pyramid of the patched plate are saved
+    written = [i for i in stitcher.writer.written if "_files/" not in i]
+    assert sorted(written) == ["plate_2", "plate_2.dzi", "well_B03"]
+    make_stitcher(
+        indexfile_path, tmp_path / "restitched", **params
+    ).stitch_and_save_all_samples_and_plates()
+    repaired = read_outputs(tmp_path / "repaired")
+    restitched = read_outputs(tmp_path / "restitched")
+    manifest_path = os.path.join(barcode, "manifest.json")
+    assert json.loads(repaired.pop(manifest_path))["missing_images"] == []
+    restitched.pop(manifest_path)
+    assert repaired == restitched
+
+
+def test_repair_titration_plate_only_repairs_plates(tmp_path):
+    indexfile_path, params, barcode = stitch_with_missing_image(
+        tmp_path, "T01000001__2021-01-01T00_00_00-Measurement 1", samples=False
+    )
+    stitcher = make_stitcher(indexfile_path, tmp_path / "repaired", **params)
+    stitcher.repair_missing_images(samples=False)
+    assert stitcher.missing_images == []
+    assert sorted(stitcher.writer.written) == ["plate_2"]
+    outputs = os.listdir(tmp_path / "repaired" / barcode)
+    assert sorted(outputs) == ["manifest.json", "plate_1.png", "plate_2.png"]
+
+
+def test_container_unchanged_when_stitched_again(tmp_path):
+    indexfile_path = make_plate(tmp_path)
+    params = dict(output_mode="container", skip_unchanged=True)
+    make_stitcher(
+        indexfile_path, tmp_path / "output", **params
+    ).stitch_and_save_all_samples_and_plates()
+    container_path = tmp_path / "output" / "S01000001" / CONTAINER_NAME
+    assert len(ContainerReader(str(container_path)).names()) == 98
+    saved = container_path.read_bytes()
+    stitcher = make_stitcher(indexfile_path, tmp_path / "output", **params)
+    stitcher.stitch_and_save_all_samples_and_plates()
+    assert stitcher.stale_outputs == set()
+    assert stitcher.writer is None
+    assert container_path.read_bytes() == saved
+
+
+def test_repair_container_restitches_plate(tmp_path, monkeypatch):
+    indexfile_path, params, barcode = stitch_with_missing_image(
+        tmp_path, PLATE_DIR, samples=True, output_mode="container"
+    )
+    container_path = tmp_path / "repaired" / barcode / CONTAINER_NAME
+    saved = container_path.read_bytes()
+
+    def load_imgs(rows):
+        raise ConnectionError("Harmony is unavailable")
+
+    stitcher = make_stitcher(indexfile_path, tmp_path / "repaired", **params)
+    monkeypatch.setattr(stitcher, "load_imgs", load_imgs)
+    # the container is left as it is until the restitched plate is saved
+    with pytest.raises(ConnectionError):
+        stitcher.repair_missing_images()
+    assert container_path.read_bytes() == saved
+    stitcher = make_stitcher(indexfile_path, tmp_path / "repaired", **params)
+    stitcher.repair_missing_images()
+    assert stitcher.missing_images == []
+    make_stitcher(
+        indexfile_path, tmp_path / "restitched", **params
+    ).stitch_and_save_all_samples_and_plates()
+    repaired = ContainerReader(str(container_path))
+    restitched = ContainerReader(
+        str(tmp_path / "restitched" / barcode / CONTAINER_NAME)
+    )
+    assert len(repaired.names()) == 98
+    assert repaired.names() == restitched.names()
+    for name in restitched.names():
+        assert repaired.read_bytes(name) == restitched.read_bytes(name)
+
+
+def test_stitch_plate_only_makes_plate_montages(tmp_path):
+    indexfile_path = make_plate(tmp_path)
+    stitcher = make_stitcher(indexfile_path, tmp_path / "output")
+    stitcher.stitch_plate()
+    assert sorted(stitcher.exact_img_store) == ["plate"]
+    stitcher.stitch_all_samples()
+    assert sorted(stitcher.exact_img_store) == ["plate", "sample"]
+    # both parts made together are the same as made separately
+    both = make_stitcher(indexfile_path, tmp_path / "output")
+    img_store = both.create_exact_img_store()
+    for name in ("plate", "sample"):
+        np.testing.assert_array_equal(img_store[name], stitcher.exact_img_store[name])
+    np.testing.assert_array_equal(
+        stitcher.stitch_sample("B03"),
+        make_stitcher(indexfile_path, tmp_path / "output").stitch_sample("B03"),
+    )
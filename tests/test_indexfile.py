@@ -0,0 +1,46 @@
+import os
+import sys
+
+BASE_DIR = os.path.dirname(__file__)
+TEST_DATA_DIR = os.path.join(BASE_DIR, "test_data")
+INDEXFILE_PATH = os.path.join(TEST_DATA_DIR, "indexfile.txt")
+MISSING_IMG_PATH = os.path.join(TEST_DATA_DIR, "placeholder_image.png")
+
+sys.path.append(os.path.join(BASE_DIR, "..", "launcher"))
+from indexfile import Indexfile, UrlFixer
+
+
+def test_indexfile_grid():
+    indexfile = Indexfile.read(INDEXFILE_PATH, MISSING_IMG_PATH)
+    assert indexfile.urls.shape == (16, 24, 2)
+    assert len(indexfile) == 768
+    rows = list(indexfile.rows())
+    assert len(rows) == 768
+    assert [row.key for row in rows[:3]] == [(1, 1, 1), (1, 1, 2), (1, 2, 1)]
+    assert all(row.channel == 2 for row in indexfile.rows(2))
+    assert indexfile.channel_names == {1: "DAPI", 2: "Alexa 488"}
+    a01 = indexfile.get(1, 1, 1)
+    assert a01.url.endswith("91-313-126-63-34-913-413-1511.tiff")
+    assert indexfile.is_present(a01)
+
+
+def test_indexfile_missing_wells_use_placeholder(tmp_path):
+    with open(INDEXFILE_PATH) as f:
+        lines = f.readlines()
+    # drop both channels of the first well
+    path = os.path.join(tmp_path, "indexfile.txt")
+    with open(path, "w") as f:
+        f.writelines(lines[:1] + lines[3:])
+    indexfile = Indexfile.read(path, MISSING_IMG_PATH)
+    row = indexfile.get(1, 1, 2)
+    assert row.url == MISSING_IMG_PATH
+    assert not indexfile.is_present(row)
+    # the test indexfile is already missing an image from the last well
+    assert indexfile.present.sum() == 765
+
+
+def test_url_fixer_replaces_harmony_names():
+    fix_url = UrlFixer({"5krrqd3": "10.6.58.91"})
+    url = "http://5krrqd3/Images/C/5krrqd3.tiff"
+    assert fix_url(url) == "http://10.6.58.91/Images/C/5krrqd3.tiff"
+    assert fix_url("/nemo/placeholder.png") == "/nemo/placeholder.png"
@@ -0,0 +1,46 @@
+import os
+import sys
+
+BASE_DIR = os.path.dirname(__file__)
+sys.path.append(os.path.join(BASE_DIR, "..", "launcher"))
+from manifest import Manifest, hash_inputs
+
+PARAMS = {"max_intensity": {"1": 800, "2": 1000}, "img_size_sample": [360, 360]}
+
+
+def make_output(tmp_path, name):
+    with open(os.path.join(tmp_path, f"{name}.png"), "wb") as f:
+        f.write(b"image")
+
+
+def test_manifest_outputs_current_after_reload(tmp_path):
+    inputs = hash_inputs([[1, 1, 1, "http://harmony/1.tiff"]])
+    manifest = Manifest(str(tmp_path), "abc", PARAMS)
+    assert not manifest.is_current("well_A01", inputs)
+    make_output(tmp_path, "well_A01")
+    manifest.record("well_A01", inputs, "well_A01.png", "sha")
+    manifest.missing_images = [[7, 7, 1]]
+    manifest.save()
+    manifest = Manifest(str(tmp_path), "abc", PARAMS)
+    assert manifest.same_indexfile
+    assert manifest.missing_images == [[7, 7, 1]]
+    assert manifest.is_current("well_A01", inputs)
+    assert not manifest.is_current("well_A01", hash_inputs([]))
+    os.remove(os.path.join(tmp_path, "well_A01.png"))
+    assert not manifest.is_current("well_A01", inputs)
+
+
+def test_manifest_ignored_when_params_change(tmp_path):
+    inputs = hash_inputs([])
+    make_output(tmp_path, "plate_1")
+    manifest = Manifest(str(tmp_path), "abc", PARAMS)
+    manifest.record("plate_1", inputs, "plate_1.png", "sha")
+    manifest.save()
+    new_params = {**PARAMS, "img_size_sample": [400, 400]}
+    assert not Manifest(str(tmp_path), "abc", new_params).is_current("plate_1", inputs)
+
+
+def test_unreadable_manifest_is_empty(tmp_path):
+    with open(os.path.join(tmp_path, "manifest.json"), "w") as f:
+        f.write("{not json")
+    assert Manifest(str(tmp_path), "abc", PARAMS).outputs == {}
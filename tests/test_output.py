@@ -0,0 +1,101 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+import skimage.io
+
+BASE_DIR = os.path.dirname(__file__)
+sys.path.append(os.path.join(BASE_DIR, "..", "launcher"))
+from output import CONTAINER_NAME, ContainerReader, ContainerWriter, ImageWriter
+
+
+def test_image_writer_saves_copies(tmp_path):
+    writer = ImageWriter(str(tmp_path), n_writers=2)
+    arr = np.zeros((10, 10), dtype=np.uint8)
+    for i in range(5):
+        arr[:] = i * 50
+        writer.write(f"img_{i}", arr)
+    writer.close()
+    for i in range(5):
+        img = skimage.io.imread(os.path.join(tmp_path, f"img_{i}.png"))
+        assert (img == i * 50).all()
+
+
+def test_image_writer_raises_write_errors(tmp_path):
+    writer = ImageWriter(os.path.join(tmp_path, "missing_dir"), n_writers=2)
+    writer.write("img", np.zeros((10, 10), dtype=np.uint8))
+    with pytest.raises(OSError):
+        writer.close()
+
+
+def test_image_writer_compression_profile_sets_extension(tmp_path):
+    arr = np.random.default_rng(0).integers(0, 255, size=(20, 30), dtype=np.uint8)
+    writer = ImageWriter(
+        str(tmp_path), n_writers=0, compression_profile="webp-lossless"
+    )
+    writer.write("img", arr)
+    writer.close()
+    # WebP has no greyscale mode, so images are decoded as RGB
+    img = skimage.io.imread(os.path.join(tmp_path, "img.webp"))
+    for channel in range(3):
+        np.testing.assert_array_equal(img[..., channel], arr)
+
+
+def test_image_writer_unknown_compression_profile(tmp_path):
+    with pytest.raises(ValueError):
+        ImageWriter(str(tmp_path), compression_profile="jpeg-2000")
+
+
+def test_container_writer_round_trip(tmp_path):
+    rng = np.random.default_rng(0)
+    imgs = {
+        f"well_{i}": rng.integers(0, 255, size=(20, 30), dtype=np.uint8)
+        for i in range(5)
+    }
+    writer = ContainerWriter(str(tmp_path), n_writers=2)
+    for name, arr in imgs.items():
+        writer.write(name, arr)
+    writer.close()
+    assert os.listdir(tmp_path) == [CONTAINER_NAME]
+    reader = ContainerReader(os.path.join(tmp_path, CONTAINER_NAME))
+    assert reader.names() == sorted(imgs)
+    for name, arr in imgs.items():
+        np.testing.assert_array_equal(reader.read(name), arr)
+    with pytest.raises(KeyError):
+        reader.read("well_6")
+    # a new writer reads images from the saved container
+    writer = ContainerWriter(str(tmp_path), n_writers=2)
+    np.testing.assert_array_equal(writer.read("well_0"), imgs["well_0"])
+    writer.close()
+
+
+def test_container_writer_keeps_images_not_saved_again(tmp_path):
+    rng = np.random.default_rng(0)
+    imgs = {
+        f"well_{i}": rng.integers(0, 255, size=(20, 30), dtype=np.uint8)
+        for i in range(5)
+    }
+    writer = ContainerWriter(str(tmp_path), n_writers=2)
+    for name, arr in imgs.items():
+        writer.write(name, arr)
+    writer.close()
+    container_path = os.path.join(tmp_path, CONTAINER_NAME)
+    # closing a writer which saved nothing leaves the container as it is
+    with open(container_path, "rb") as f:
+        saved = f.read()
+    ContainerWriter(str(tmp_path), n_writers=2).close()
+    with open(container_path, "rb") as f:
+        assert f.read() == saved
+    assert os.listdir(tmp_path) == [CONTAINER_NAME]
+    # saving some images again copies the others across
+    imgs["well_2"] = np.zeros((20, 30), dtype=np.uint8)
+    writer = ContainerWriter(str(tmp_path), n_writers=2)
+    writer.write("well_2", imgs["well_2"])
+    writer.write_bytes("plate_1.dzi", b"descriptor")
+    writer.close()
+    reader = ContainerReader(container_path)
+    assert reader.names() == sorted([*imgs, "plate_1.dzi"])
+    for name, arr in imgs.items():
+        np.testing.assert_array_equal(reader.read(name), arr)
+    assert reader.read_bytes("plate_1.dzi") == b"descriptor"
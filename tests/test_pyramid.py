@@ -0,0 +1,38 @@
+import os
+import sys
+
+import numpy as np
+
+BASE_DIR = os.path.dirname(__file__)
+sys.path.append(os.path.join(BASE_DIR, "..", "launcher"))
+import pyramid
+
+
+def test_levels_halve_down_to_single_pixel():
+    img = np.full((300, 517), 100, dtype=np.uint8)
+    levels = list(pyramid.iter_levels(img))
+    assert [level for level, _ in levels] == list(reversed(range(11)))
+    assert levels[0][1].shape == (300, 517)
+    assert levels[1][1].shape == (150, 259)
+    assert levels[-1][1].shape == (1, 1)
+    assert all((level_img == 100).all() for _, level_img in levels)
+
+
+def test_halve_block_mean():
+    img = np.array([[0, 2, 9], [4, 6, 9]], dtype=np.uint8)
+    np.testing.assert_array_equal(pyramid.halve(img), [[3, 9]])
+
+
+def test_tiles_cover_image():
+    img = np.random.default_rng(0).integers(0, 255, size=(300, 517), dtype=np.uint8)
+    tiles = list(pyramid.iter_tiles(img, 256))
+    assert [(col, row) for col, row, _ in tiles] == [
+        (0, 0),
+        (1, 0),
+        (2, 0),
+        (0, 1),
+        (1, 1),
+        (2, 1),
+    ]
+    assert tiles[-1][2].shape == (44, 5)
+    np.testing.assert_array_equal(tiles[4][2], img[256:, 256:512])
@@ -0,0 +1,164 @@
+import os
+import sys
+import time
+
+BASE_DIR = os.path.dirname(__file__)
+sys.path.append(os.path.join(BASE_DIR, "..", "launcher"))
+import snapshot
+
+REGEX = r"^[A-Z][0-9]{8}_.*-Measurement [0-9]$"
+PLATES = [
+    "S01000001__2021-01-01T00_00_00-Measurement 1",
+    "T01000002__2021-01-01T00_00_00-Measurement 1",
+]
+
+
+def make_snapshot(tmp_path, dirnames, full_scan_interval=0):
+    results_dir = tmp_path / "results"
+    results_dir.mkdir(exist_ok=True)
+    for dirname in dirnames:
+        (results_dir / dirname).mkdir(exist_ok=True)
+    db_path = str(tmp_path / "snapshot.db")
+    return snapshot.Snapshot(
+        str(results_dir), db_path, regex=REGEX, full_scan_interval=full_scan_interval
+    )
+
+
+def count_listings(monkeypatch):
+    n_listings = []
+    scandir = os.scandir
+    monkeypatch.setattr(
+        snapshot.os, "scandir", lambda path: n_listings.append(path) or scandir(path)
+    )
+    return n_listings
+
+
+def set_mtime_in_past(path):
+    past = time.time() - 100
+    os.utime(path, (past, past))
+
+
+def test_cycle_lists_directory_once(tmp_path, monkeypatch):
+    snap = make_snapshot(tmp_path, PLATES + ["not_a_plate"])
+    n_listings = count_listings(monkeypatch)
+    cycle = snap.cycle()
+    assert not cycle.is_unchanged
+    new_dirs = cycle.get_new_dirs()
+    cycle.save()
+    assert len(n_listings) == 1
+    assert new_dirs == [os.path.join(snap.parent_dir, i) for i in PLATES]
+    assert snap.stored_hash == cycle.current_hash == snap.current_hash
+
+
+def test_cycle_finds_only_new_dirs(tmp_path):
+    snap = make_snapshot(tmp_path, PLATES[:1])
+    snap.cycle().save()
+    assert snap.cycle().is_unchanged
+    snap = make_snapshot(tmp_path, PLATES)
+    cycle = snap.cycle()
+    assert not cycle.is_unchanged
+    assert cycle.get_new_dirs() == [os.path.join(snap.parent_dir, PLATES[1])]
+
+
+def test_diff_and_apply_delta(tmp_path):
+    db = snapshot.SnapshotDB(str(tmp_path / "snapshot.db"))
+    assert db.con.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    db.create_snapshot(["a", "b", "c"])
+    new_dirs, removed_dirs = db.diff(["d", "c", "a", "a"])
+    assert new_dirs == ["d"]
+    assert removed_dirs == ["b"]
+    db.apply_delta(new_dirs, removed_dirs, "hash")
+    stored = db.con.execute("SELECT id FROM snapshot ORDER BY id").fetchall()
+    assert [i for (i,) in stored] == ["a", "c", "d"]
+    assert db.get_hash() == "hash"
+    assert db.diff(["a", "c", "d"]) == ([], [])
+
+
+def test_save_without_fresh_keeps_removed_dirs(tmp_path):
+    snap = make_snapshot(tmp_path, PLATES)
+    snap.cycle().save()
+    (tmp_path / "results" / PLATES[0]).rmdir()
+    snap.cycle().save(fresh=False)
+    assert not snap.db.is_new_dir(PLATES[0])
+    snap.cycle().save()
+    assert snap.db.is_new_dir(PLATES[0])
+
+
+def test_unmodified_directory_is_not_listed(tmp_path, monkeypatch):
+    snap = make_snapshot(tmp_path, PLATES[:1], full_scan_interval=3600)
+    set_mtime_in_past(snap.parent_dir)
+    snap.cycle().save()
+    n_listings = count_listings(monkeypatch)
+    cycle = snap.cycle()
+    assert not cycle.scan
+    assert cycle.is_unchanged
+    assert cycle.get_new_dirs() == []
+    assert n_listings == []
+    # adding a directory modifies the parent directory
+    (tmp_path / "results" / PLATES[1]).mkdir()
+    cycle = snap.cycle()
+    assert cycle.scan
+    assert cycle.get_new_dirs() == [os.path.join(snap.parent_dir, PLATES[1])]
+    assert len(n_listings) == 1
+
+
+def test_full_scan_interval(tmp_path):
+    snap = make_snapshot(tmp_path, PLATES, full_scan_interval=3600)
+    set_mtime_in_past(snap.parent_dir)
+    snap.cycle().save()
+    assert not snap.cycle().scan
+    dir_stat = snap.db.get_dir_stat()
+    snap.db.add_dir_stat(dir_stat._replace(scanned_at=dir_stat.scanned_at - 3600))
+    assert snap.cycle().scan
+    snap.full_scan_interval = 0
+    snap.cycle().save()
+    assert snap.cycle().scan
+
+
+def test_recently_modified_directory_is_listed(tmp_path):
+    snap = make_snapshot(tmp_path, PLATES, full_scan_interval=3600)
+    snap.cycle().save()
+    # modified within the timestamp granularity of the last listing
+    assert snap.cycle().scan
+
+
+def test_record_scan_of_unchanged_contents(tmp_path):
+    snap = make_snapshot(tmp_path, PLATES, full_scan_interval=3600)
+    snap.cycle().save()
+    # a directory which doesn't match the regex doesn't change the contents
+    (tmp_path / "results" / "not_a_plate").mkdir()
+    set_mtime_in_past(snap.parent_dir)
+    cycle = snap.cycle()
+    assert cycle.scan
+    assert cycle.is_unchanged
+    cycle.record_scan()
+    assert not snap.cycle().scan
+
+
+def test_pending_dirs(tmp_path):
+    snap = make_snapshot(tmp_path, PLATES)
+    snap.track_pending = True
+    snap.cycle().save()
+    assert [i for i, _ in snap.db.get_pending()] == PLATES
+    snap.db.rm_pending(PLATES[:1])
+    assert [i for i, _ in snap.db.get_pending()] == PLATES[1:]
+    # removed directories are no longer pending
+    os.rmdir(os.path.join(snap.parent_dir, PLATES[1]))
+    snap.cycle().save()
+    assert snap.db.get_pending() == []
+
+
+def test_awaiting_analysis_dirs(tmp_path):
+    snap = make_snapshot(tmp_path, PLATES)
+    snap.cycle().save()
+    snap.db.add_awaiting_analysis(PLATES[:2])
+    # adding a directory again keeps when it was first seen
+    first_seen = dict(snap.db.get_awaiting_analysis())
+    snap.db.add_awaiting_analysis(PLATES[:1])
+    assert dict(snap.db.get_awaiting_analysis()) == first_seen
+    snap.db.rm_awaiting_analysis(PLATES[:1])
+    assert [i for i, _ in snap.db.get_awaiting_analysis()] == PLATES[1:2]
+    # removed directories are no longer awaiting analysis
+    os.rmdir(os.path.join(snap.parent_dir, PLATES[1]))
+    snap.cycle().save()
+    assert snap.db.get_awaiting_analysis() == []
@@ -0,0 +1,76 @@
+import os
+import sys
+import threading
+import time
+
+BASE_DIR = os.path.dirname(__file__)
+sys.path.append(os.path.join(BASE_DIR, "..", "launcher"))
+import watcher
+
+MOUNTS = """\
+sysfs /sys sysfs rw,nosuid,nodev,noexec,relatime 0 0
+/dev/sda1 / ext4 rw,relatime 0 0
+server:/proj /mnt/proj-c19 nfs4 rw,relatime 0 0
+server:/other /mnt/proj\\040c19 nfs rw,relatime 0 0
+"""
+
+
+def test_get_fs_type(tmp_path):
+    mounts_path = tmp_path / "mounts"
+    mounts_path.write_text(MOUNTS)
+    for path, fs_type in [
+        ("/mnt/proj-c19/working/NA_raw_data", "nfs4"),
+        ("/mnt/proj-c19", "nfs4"),
+        ("/mnt/proj c19/working", "nfs"),
+        ("/mnt/proj-c19-other", "ext4"),
+        ("/home", "ext4"),
+    ]:
+        assert watcher.get_fs_type(path, str(mounts_path)) == fs_type
+    assert watcher.get_fs_type("/home", str(tmp_path / "missing")) is None
+
+
+def test_inotify_sees_new_directory(tmp_path):
+    inotify = watcher.Inotify(str(tmp_path))
+    try:
+        assert inotify.wait(0) == 0
+        (tmp_path / "new_plate").mkdir()
+        assert inotify.wait(1) & watcher.IN_CREATE
+        assert inotify.wait(0) == 0
+    finally:
+        inotify.close()
+
+
+def test_polling_backs_off_until_a_change(tmp_path):
+    fs_type = watcher.get_fs_type(str(tmp_path))
+    dir_watcher = watcher.DirectoryWatcher(
+        str(tmp_path),
+        poll_min_interval=5,
+        poll_max_interval=30,
+        network_fs_types=(fs_type,),
+    )
+    assert dir_watcher.inotify is None
+    waits = []
+
+    class Stop(threading.Event):
+        def wait(self, timeout=None):
+            waits.append(timeout)
+
+    for changed in [False, False, True, False, False, False, False, True]:
+        dir_watcher.wait(changed, Stop())
+    assert waits == [5, 10, 5, 10, 20, 30, 30, 5]
+
+
+def test_inotify_wakes_on_change(tmp_path):
+    dir_watcher = watcher.DirectoryWatcher(
+        str(tmp_path), poll_max_interval=30, settle_time=0, network_fs_types=()
+    )
+    assert dir_watcher.inotify is not None
+    timer = threading.Timer(0.1, (tmp_path / "new_plate").mkdir)
+    timer.start()
+    try:
+        start = time.monotonic()
+        dir_watcher.wait(changed=False, stop=threading.Event())
+        assert time.monotonic() - start < 5
+    finally:
+        timer.join()
+        dir_watcher.close()